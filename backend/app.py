@@ -1,4 +1,4 @@
-from fastapi import Request, FastAPI, UploadFile, Form, File
+from fastapi import Request, FastAPI, UploadFile, Form, File, HTTPException
 import psycopg2
 import uuid
 def ensure_questionnaire_exists():
@@ -18,65 +18,102 @@ app = FastAPI()
 @app.on_event("startup")
 def startup_event():
     ensure_questionnaire_exists()
+    from services.job_queue import ensure_job_table
+    ensure_job_table()
+    from services.vector_index import ensure_vector_indexes_async
+    ensure_vector_indexes_async()
 
 @app.post("/upload")
 async def upload(files: list[UploadFile] = File(...), session_id: str = Form(...)):
     file_paths = []
-    import os
+    file_infos = []
+    from services.file_service import build_upload_path, save_upload_stream, remove_files, UploadTooLarge
     for uploaded_file in files:
         filename = uploaded_file.filename if uploaded_file.filename is not None else "unknown"
-        safe_name = os.path.basename(filename)
-        unique_name = f"{session_id}_{uuid.uuid4().hex}_{safe_name}"
-        file_path = f"/tmp/{unique_name}"
-        with open(file_path, "wb") as f:
-            f.write(await uploaded_file.read())
+        file_path = build_upload_path(session_id, filename, uuid.uuid4().hex)
+        # 分块流式写盘，避免整个文件驻留内存
+        try:
+            size, sha256 = await save_upload_stream(uploaded_file, file_path)
+        except UploadTooLarge as e:
+            # 请求被拒绝时清理本次已写入的文件，UPLOAD_DIR 是持久卷，不清理会一直堆积
+            remove_files(file_paths)
+            raise HTTPException(status_code=413, detail=str(e))
+        except BaseException:
+            remove_files(file_paths)
+            raise
         file_paths.append(file_path)
-    # RAG自动问卷更新
-    from services.update_questionnaire import update_from_document
-    update_from_document(session_id, file_paths)
-    # 修改：收集RAG检索内容和summary
-    rag_contexts = {}
-    summary = []
-    from langchain_community.embeddings import DashScopeEmbeddings
-    from langchain_postgres.vectorstores import PGVector
-    import os
-    from dotenv import load_dotenv
-    load_dotenv()
-    api_key = os.environ.get("DASHSCOPE_API_KEY")
-    kpi_questions = {
-        "scope1": "企业的Scope 1（直接排放）是多少？",
-        "scope2": "企业的Scope 2（能源间接排放）是多少？",
-        "scope3": "企业的Scope 3（上下游其他间接排放）是多少？",
-        "energy_total": "企业的总能耗是多少？",
-        "renewable_ratio": "企业的可再生能源占比是多少？",
-        "hazardous_waste": "企业的危险废弃物总量是多少？",
-        "nonhazardous_waste": "企业的非危险废弃物总量是多少？",
-        "recycled_waste": "企业的回收/再利用废弃物总量是多少？"
-    }
-    embeddings = DashScopeEmbeddings(model="text-embedding-v1", dashscope_api_key=api_key)
-    vectorstore = PGVector(
-        embeddings,
-        connection=os.getenv("PGVECTOR_CONN", "postgresql://admin:admin@db:5432/esg_memory"),
-        collection_name=f"session_{session_id}",
-        use_jsonb=True
-    )
-    for key, question in kpi_questions.items():
-        docs = vectorstore.similarity_search(question, k=1)
-        if docs:
-            rag_contexts[key] = docs[0].page_content
-            summary.append(f"[{key}] {question}\n→ {docs[0].page_content[:200]}...")
-        else:
-            rag_contexts[key] = "未检索到相关内容"
-            summary.append(f"[{key}] {question}\n→ 未检索到相关内容")
-    # 将rag_contexts和summary写入answers表
-    from services.rag_service import save_answers
-    answer_update = {"_rag_contexts": rag_contexts, "_summary": "\n\n".join(summary)}
-    save_answers(session_id, answer_update, {}, {})
-    from chains.questionnaire_chain import get_questionnaire
-    result = get_questionnaire(session_id)
-    result["rag_contexts"] = rag_contexts
-    result["summary"] = "\n\n".join(summary)
-    return result
+        file_infos.append({"filename": filename, "size": size, "sha256": sha256})
+    # 入队后立即返回，由独立 worker 进程执行解析、向量化与问卷抽取
+    from services.job_queue import enqueue_job
+    try:
+        job_id = enqueue_job(session_id, file_paths, file_infos)
+    except BaseException:
+        remove_files(file_paths)
+        raise
+    return {"job_id": job_id, "status": "queued", "session_id": session_id, "files": file_infos}
+
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    from services.job_queue import get_job
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job
+
+@app.get("/embedding_cache/stats")
+async def embedding_cache_stats():
+    from services.embedding_cache import get_cache_stats
+    return get_cache_stats()
+
+@app.get("/embedding_metrics")
+async def embedding_metrics():
+    from services.embedding_batcher import get_embedding_metrics
+    return get_embedding_metrics()
+
+@app.get("/render_cache/stats")
+async def render_cache_stats():
+    from services.render_cache import get_render_cache_stats
+    return get_render_cache_stats()
+
+@app.get("/vl/stats")
+async def vl_stats():
+    from services.vl_client import get_vl_stats
+    return get_vl_stats()
+
+@app.get("/vectorstore_cache/stats")
+async def vectorstore_cache_stats():
+    from services.rag_service import get_vectorstore_cache_stats
+    return get_vectorstore_cache_stats()
+
+@app.get("/vector_index/stats")
+async def vector_index_stats():
+    from services.vector_index import get_vector_index_stats
+    return get_vector_index_stats()
+
+@app.get("/lexical_index/stats")
+async def lexical_index_stats():
+    from services.lexical_index import get_lexical_index_stats
+    return get_lexical_index_stats()
+
+@app.get("/mmap_index/stats")
+async def mmap_index_stats():
+    from services.mmap_index import get_mmap_index_stats
+    return get_mmap_index_stats()
+
+@app.get("/rerank/stats")
+async def rerank_stats():
+    from services.reranker import get_rerank_stats
+    return get_rerank_stats()
+
+@app.get("/dedup/stats")
+async def dedup_stats():
+    from services.near_duplicates import get_dedup_stats
+    return get_dedup_stats()
+
+@app.get("/rag/stats")
+async def rag_stats():
+    from services.rag_service import get_rag_stats
+    return get_rag_stats()
 
 @app.post("/chat")
 async def chat(message: str = Form(...), session_id: str = Form(...)):
@@ -98,7 +135,7 @@ async def module_summary(session_id: str = Form(...), key: str = Form(None)):
     key can be one of: quantitative_target, energy_measures, waste_measures, or omitted/"all" to run all.
     Returns detected modules, per-module measures, and a one-line summary for each requested key.
     """
-    from services.rag_service import search_docs, run_module_level_rag, get_llm, _ai_to_text
+    from services.rag_service import search_docs, search_docs_batch, run_module_level_rag, get_llm, _ai_to_text
 
     questions = {
         "quantitative_target": f"{session_id}: 政策中是否包含定量目标？输出目标数值与年份，如 减少排放20% by 2030",
@@ -133,9 +170,10 @@ async def module_summary(session_id: str = Form(...), key: str = Form(None)):
     answer_sources = {}
     answer_conflicts = {}
 
+    retrieved = search_docs_batch(session_id, [questions[k] for k in keys], k=5)
     for k in keys:
         q = questions[k]
-        docs = search_docs(session_id, q, k=5)
+        docs = retrieved.get(q, [])
         modules, module_details, summary = run_module_level_rag(session_id, k, company_name, docs)
         results[k] = {
             "modules": modules,
@@ -199,13 +237,17 @@ async def update_answers(session_id: str = Form(...), answers: str = Form(...)):
                     existing = json.loads(existing)
                 source_data = {}
                 conflict_data = {}
+                retrieval_data = {}
                 if isinstance(existing, dict):
                     source_data = existing.get("_sources", {})
                     conflict_data = existing.get("_conflicts", {})
+                    retrieval_data = existing.get("_retrieval", {})
                 updated = json.loads(answers)
                 if isinstance(updated, dict):
                     updated["_sources"] = source_data
                     updated["_conflicts"] = conflict_data
+                    if retrieval_data:
+                        updated.setdefault("_retrieval", retrieval_data)
                 cur.execute("UPDATE answers SET answers=%s WHERE id=%s", (json.dumps(updated), answer_id))
             else:
                 cur.execute("INSERT INTO answers (session_id, questionnaire_id, answers) VALUES (%s, %s, %s)", (session_id, 1, answers))
@@ -0,0 +1,117 @@
+"""
+测量 langchain_pg_embedding 上按 collection 过滤的相似度检索延迟随语料规模的变化：
+顺序扫描（禁用索引）对比 ANN 索引（VECTOR_INDEX_TYPE），并给出 ANN 相对精确结果的召回率。
+向量为随机生成，不调用 embedding 服务。会在库中建索引并写入基准数据，请在测试库上运行。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_ann_latency --sizes 10000,50000,100000 --collections 20 --queries 50
+"""
+import os
+import sys
+import time
+import uuid
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_vector_insert import open_collection
+
+QUERY_SQL = """
+    SELECT id FROM langchain_pg_embedding
+    WHERE collection_id = (SELECT uuid FROM langchain_pg_collection WHERE name = %s)
+    ORDER BY embedding <=> %s::vector
+    LIMIT %s
+"""
+
+
+def random_vector(dim):
+    return [random.random() - 0.5 for _ in range(dim)]
+
+
+def grow(names, rows, dim, batch):
+    """Spread rows evenly across the benchmark collections using binary COPY."""
+    from services.pgvector_bulk import bulk_insert_embeddings
+    per_collection = rows // len(names)
+    for name in names:
+        for i in range(0, per_collection, batch):
+            n = min(batch, per_collection - i)
+            texts = [f"基准分块 {name} {i + j}" for j in range(n)]
+            metadatas = [{"source_file": "bench.pdf", "page": 0, "type": "text"} for _ in range(n)]
+            bulk_insert_embeddings(name, texts, metadatas, [random_vector(dim) for _ in range(n)])
+
+
+def measure(collection, queries, k, exact):
+    from db.db import get_conn
+    from services.vector_index import apply_search_settings
+    latencies = []
+    results = []
+    conn = get_conn()
+    for vector in queries:
+        literal = "[" + ",".join(repr(x) for x in vector) + "]"
+        with conn:
+            with conn.cursor() as cur:
+                if exact:
+                    cur.execute("SET LOCAL enable_indexscan = off")
+                    cur.execute("SET LOCAL enable_bitmapscan = off")
+                else:
+                    apply_search_settings(cur)
+                started = time.perf_counter()
+                cur.execute(QUERY_SQL, (collection, literal, k))
+                rows = cur.fetchall()
+                latencies.append((time.perf_counter() - started) * 1000)
+        results.append([r[0] for r in rows])
+    conn.close()
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2]
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    return p50, p95, results
+
+
+def recall(approx, exact, k):
+    hits = sum(len(set(a) & set(e)) for a, e in zip(approx, exact))
+    return hits / (k * len(exact)) if exact else 0.0
+
+
+def run(sizes, dim, collections, queries, k, batch):
+    from services.vector_index import ensure_vector_indexes, VECTOR_INDEX_TYPE, EMBEDDING_DIM
+
+    if dim != EMBEDDING_DIM:
+        raise SystemExit(f"--dim={dim} 与 EMBEDDING_DIM={EMBEDDING_DIM} 不一致，ANN 索引只覆盖固定维度的 embedding 列")
+
+    prefix = f"bench_ann_{uuid.uuid4().hex[:8]}"
+    stores = [open_collection(f"{prefix}_{i}", dim) for i in range(collections)]
+    names = [s.collection_name for s in stores]
+    query_vectors = [random_vector(dim) for _ in range(queries)]
+    loaded = 0
+    print(f"index={VECTOR_INDEX_TYPE} dim={dim} collections={collections} queries={queries} k={k}")
+    print(f"{'rows':>10} {'seq p50':>9} {'seq p95':>9} {'ann p50':>9} {'ann p95':>9} {'recall':>7}")
+    try:
+        for size in sorted(sizes):
+            grow(names, size - loaded, dim, batch)
+            loaded = size
+            status = ensure_vector_indexes()
+            if not status["ready"]:
+                # 没有 ANN 索引时 "ann" 列只是又一次顺序扫描，召回恒为 1，结果没有意义
+                raise SystemExit(f"ANN 索引未就绪: {status['last_error']}")
+            seq_p50, seq_p95, exact = measure(names[0], query_vectors, k, exact=True)
+            ann_p50, ann_p95, approx = measure(names[0], query_vectors, k, exact=False)
+            print(
+                f"{size:>10} {seq_p50:>7.2f}ms {seq_p95:>7.2f}ms "
+                f"{ann_p50:>7.2f}ms {ann_p95:>7.2f}ms {recall(approx, exact, k):>7.3f}"
+            )
+    finally:
+        for store in stores:
+            store.delete_collection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10000,50000,100000", help="逗号分隔的语料总行数")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--collections", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args()
+    run([int(s) for s in args.sizes.split(",")], args.dim, args.collections, args.queries, args.k, args.batch)
@@ -0,0 +1,74 @@
+"""
+对比 embedding 提供方的吞吐（chunks/s）：远程 DashScope（分批并发）与本地 CPU
+sentence-transformers（torch / ONNX / ONNX int8 量化）。不经过 embedding 缓存。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_embeddings --chunks 500 --providers dashscope,torch,onnx,onnx-int8
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_chunks(n):
+    phrases = [
+        "公司范围一直接排放为 12,345 吨二氧化碳当量，",
+        "可再生能源占总能耗的 23.5%，",
+        "危险废弃物产生量 1,020 千克并全部交由有资质单位处置，",
+        "我们持续推进节能改造与光伏项目建设，",
+        "排放核算遵循 GHG Protocol 并经第三方核查。",
+    ]
+    # 长度不一的分块，模拟 chunk_size=500 的切分结果
+    return ["".join(random.choice(phrases) for _ in range(random.randint(3, 18))) for _ in range(n)]
+
+
+def build_provider(name):
+    if name == "dashscope":
+        from langchain_community.embeddings import DashScopeEmbeddings
+        from services.embedding_batcher import BatchedEmbeddings
+        from services.rag_service import EMBEDDING_MODEL
+        return BatchedEmbeddings(DashScopeEmbeddings(model=EMBEDDING_MODEL, dashscope_api_key=os.environ.get("DASHSCOPE_API_KEY")))
+    from services.local_embeddings import LocalEmbeddings
+    if name == "torch":
+        return LocalEmbeddings(backend="torch")
+    if name == "onnx":
+        return LocalEmbeddings(backend="onnx", quantize="none")
+    if name == "onnx-int8":
+        return LocalEmbeddings(backend="onnx", quantize="int8")
+    raise ValueError(f"未知 provider: {name}")
+
+
+def run(chunks, providers, repeat):
+    texts = make_chunks(chunks)
+    avg_len = sum(len(t) for t in texts) / len(texts)
+    print(f"chunks={chunks} avg_chars={avg_len:.0f} repeat={repeat}")
+    for name in providers:
+        try:
+            started = time.perf_counter()
+            provider = build_provider(name)
+            load_s = time.perf_counter() - started
+            # 预热一次，排除首批的图优化/连接建立开销
+            provider.embed_documents(texts[:8])
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                vectors = provider.embed_documents(texts)
+                timings.append(time.perf_counter() - started)
+            best = min(timings)
+            variant = getattr(provider, "variant", name)
+            print(f"  {variant:<40} dim={len(vectors[0]):<5} load {load_s:6.2f}s  best {best:7.2f}s  {chunks / best:9.1f} chunks/s")
+        except Exception as e:
+            print(f"  {name:<40} 失败: {e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=500)
+    parser.add_argument("--providers", default="dashscope,torch,onnx,onnx-int8")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    run(args.chunks, args.providers.split(","), args.repeat)
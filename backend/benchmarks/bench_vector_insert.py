@@ -0,0 +1,68 @@
+"""
+对比 PGVector.add_embeddings（逐行 INSERT）与二进制 COPY 批量写入的耗时。
+向量为随机生成，不调用 embedding 服务，只衡量写库开销。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_vector_insert --chunks 5000 --dim 1536 --batch 500
+"""
+import os
+import sys
+import time
+import uuid
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_rows(n, dim):
+    texts = [f"基准测试分块 {i}：" + "排放数据 " * 40 for i in range(n)]
+    metadatas = [{"source_file": "bench.pdf", "page": i // 10, "type": "text", "content_hash": "bench"} for i in range(n)]
+    vectors = [[random.random() for _ in range(dim)] for _ in range(n)]
+    return texts, metadatas, vectors
+
+
+def open_collection(name, dim):
+    from langchain_postgres.vectorstores import PGVector
+    from langchain_core.embeddings import FakeEmbeddings
+    return PGVector(
+        FakeEmbeddings(size=dim),
+        connection=os.getenv("PGVECTOR_CONN", "postgresql://admin:admin@db:5432/esg_memory"),
+        collection_name=name,
+        # 新库首次建表时声明 vector(dim)，否则无法创建 ANN 索引
+        embedding_length=dim,
+        use_jsonb=True,
+    )
+
+
+def run(chunks, dim, batch):
+    from services.pgvector_bulk import bulk_insert_embeddings
+
+    texts, metadatas, vectors = make_rows(chunks, dim)
+    results = {}
+    for mode in ("orm", "copy"):
+        name = f"bench_{mode}_{uuid.uuid4().hex[:8]}"
+        store = open_collection(name, dim)
+        started = time.perf_counter()
+        for i in range(0, chunks, batch):
+            sl = slice(i, i + batch)
+            if mode == "orm":
+                store.add_embeddings(texts[sl], vectors[sl], metadatas=metadatas[sl])
+            else:
+                bulk_insert_embeddings(name, texts[sl], metadatas[sl], vectors[sl])
+        results[mode] = time.perf_counter() - started
+        store.delete_collection()
+
+    print(f"chunks={chunks} dim={dim} batch={batch}")
+    for mode, elapsed in results.items():
+        print(f"  {mode:<5} {elapsed:8.2f}s  {chunks / elapsed:10.1f} rows/s")
+    print(f"  speedup copy vs orm: {results['orm'] / results['copy']:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--batch", type=int, default=500)
+    args = parser.parse_args()
+    run(args.chunks, args.dim, args.batch)
@@ -30,20 +30,8 @@ def build_agent(session_id):
     summarization_llm = ChatTongyi(model="qwen-flash", api_key=SecretStr(str(api_key)))
     # 工具：RAG 检索
     def rag_tool_func(input, session_id=None):
-        from langchain_postgres.vectorstores import PGVector
-        from langchain_community.embeddings import DashScopeEmbeddings
-        import os
-        from dotenv import load_dotenv
-        load_dotenv()
-        api_key = os.environ.get("DASHSCOPE_API_KEY")
-        embeddings = DashScopeEmbeddings(model="text-embedding-v1", dashscope_api_key=api_key)
-        vectorstore = PGVector(
-            embeddings,
-            connection=os.getenv("PGVECTOR_CONN", "postgresql://admin:admin@db:5432/esg_memory"),
-            collection_name=f"session_{session_id}",
-            use_jsonb=True
-        )
-        docs = vectorstore.similarity_search(input, k=2)
+        from services.rag_service import search_docs
+        docs = search_docs(session_id, input, k=2)
         if docs:
             return "\n\n".join([d.page_content for d in docs])
         return ""
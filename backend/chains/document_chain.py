@@ -1,7 +1,5 @@
 from langchain_community.document_loaders import TextLoader, PDFPlumberLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import DashScopeEmbeddings
-from langchain_postgres.vectorstores import PGVector
 import os
 from dotenv import load_dotenv
 load_dotenv()
@@ -11,48 +9,49 @@ def process_and_store_document(file_path, session_id):
     # 1. 加载文档
     if file_path.endswith('.pdf'):
         docs = []
-        # 1. camelot/pdfplumber 提取表格
+        from langchain_core.documents import Document
+        from services.parsed_document import load_parsed_document, get_camelot_tables
+        # 解析结果以 artifact 形式落盘，文本/表格阶段共用一次解析
         try:
-            import camelot
-            tables = camelot.io.read_pdf(file_path, pages='all', flavor='stream')
-            if tables and tables.n > 0:
-                for i, table in enumerate(tables):
-                    df = table.df
-                    if df is not None and not df.empty:
-                        table_text = df.to_string(index=False)
-                        from langchain_core.documents import Document
-                        doc = Document(page_content=table_text, metadata={"source_file": os.path.basename(file_path), "table_index": i, "type": "table"})
-                        docs.append(doc)
-                print(f"camelot 提取表格数: {tables.n}")
-            else:
-                print("camelot 未提取到表格，尝试 pdfplumber")
-                import pdfplumber
-                from langchain_core.documents import Document
-                with pdfplumber.open(file_path) as pdf:
-                    for i, page in enumerate(pdf.pages):
-                        for table in page.extract_tables():
-                            if table:
-                                import pandas as pd
-                                df = pd.DataFrame(table)
-                                if not df.empty:
-                                    table_text = df.to_string(index=False)
-                                    doc = Document(page_content=table_text, metadata={"source_file": os.path.basename(file_path), "page": i, "type": "table"})
-                                    docs.append(doc)
+            artifact = load_parsed_document(file_path)
         except Exception as e:
-            print(f"表格提取异常: {e}")
-        # 2. PDFPlumberLoader 或 pdfplumber 提取全文
-        try:
+            print(f"pdfplumber 解析失败: {e}, 尝试 PDFPlumberLoader")
+            artifact = None
+        # 1. camelot/pdfplumber 提取表格
+        if artifact is not None:
             try:
-                import pdfplumber
-                from langchain_core.documents import Document
-                with pdfplumber.open(file_path) as pdf:
-                    for i, page in enumerate(pdf.pages):
-                        page_text = page.extract_text() or ""
-                        if page_text.strip():
-                            doc = Document(page_content=page_text, metadata={"source_file": os.path.basename(file_path), "page": i, "type": "text"})
-                            docs.append(doc)
+                # 先用轻量特征筛选候选页，只在候选页上运行 camelot
+                from services.table_detection import select_table_candidate_pages
+                candidate_pages = select_table_candidate_pages(artifact["pages"])
+                print(f"表格候选页: {len(candidate_pages)}/{artifact['page_count']}，跳过 {artifact['page_count'] - len(candidate_pages)} 页")
+                tables = get_camelot_tables(artifact, pages=candidate_pages)
+                if tables:
+                    for t in tables:
+                        metadata = {"source_file": os.path.basename(file_path), "table_index": t["table_index"], "type": "table"}
+                        if t.get("page") is not None:
+                            metadata["page"] = t["page"]
+                        docs.append(Document(page_content=t["text"], metadata=metadata))
+                    print(f"camelot 提取表格数: {len(tables)}")
+                else:
+                    print("camelot 未提取到表格，尝试 pdfplumber")
+                    import pandas as pd
+                    for page in artifact["pages"]:
+                        for table in page["tables"]:
+                            df = pd.DataFrame(table)
+                            if not df.empty:
+                                table_text = df.to_string(index=False)
+                                doc = Document(page_content=table_text, metadata={"source_file": os.path.basename(file_path), "page": page["page"], "type": "table"})
+                                docs.append(doc)
             except Exception as e:
-                print(f"pdfplumber 解析失败: {e}, 尝试 PDFPlumberLoader")
+                print(f"表格提取异常: {e}")
+        # 2. pdfplumber 全文（来自 artifact）或 PDFPlumberLoader
+        try:
+            if artifact is not None:
+                for page in artifact["pages"]:
+                    if page["text"].strip():
+                        doc = Document(page_content=page["text"], metadata={"source_file": os.path.basename(file_path), "page": page["page"], "type": "text"})
+                        docs.append(doc)
+            else:
                 loader = PDFPlumberLoader(file_path)
                 text_docs = loader.load()
                 for doc in text_docs:
@@ -71,13 +70,7 @@ def process_and_store_document(file_path, session_id):
     # 2. 分块
     splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
     chunks = splitter.split_documents(docs)
-    # 3. 向量化
-    embeddings = DashScopeEmbeddings(model="text-embedding-v1", dashscope_api_key=api_key)
-    # 4. 存入 pgvector
-    vectorstore = PGVector(
-        embeddings,
-        connection=os.getenv("PGVECTOR_CONN", "postgresql://admin:admin@db:5432/esg_memory"),
-        collection_name=f"session_{session_id}",
-        use_jsonb=True
-    )
+    # 3. 向量化（经 embedding 缓存）并存入 pgvector
+    from services.rag_service import get_vectorstore
+    vectorstore = get_vectorstore(session_id)
     vectorstore.add_documents(chunks)
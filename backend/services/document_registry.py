@@ -0,0 +1,142 @@
+import os
+from db.db import get_conn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def ensure_registry_table():
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS ingested_documents (
+                    content_hash VARCHAR(64) NOT NULL,
+                    session_id VARCHAR(128) NOT NULL,
+                    source_file VARCHAR(255),
+                    source_path TEXT,
+                    chunk_count INTEGER,
+                    embedding_model VARCHAR(128),
+                    embedding_dim INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (content_hash, session_id)
+                )
+                """
+            )
+            # 旧库补列：记录生成向量的模型与维度，复用分块时必须一致
+            cur.execute("ALTER TABLE ingested_documents ADD COLUMN IF NOT EXISTS embedding_model VARCHAR(128)")
+            cur.execute("ALTER TABLE ingested_documents ADD COLUMN IF NOT EXISTS embedding_dim INTEGER")
+    conn.close()
+
+
+def get_collection_id(cur, session_id):
+    cur.execute("SELECT uuid FROM langchain_pg_collection WHERE name=%s", (f"session_{session_id}",))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def session_has_document(session_id, content_hash):
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT 1 FROM ingested_documents WHERE content_hash=%s AND session_id=%s",
+                (content_hash, session_id),
+            )
+            found = cur.fetchone() is not None
+    conn.close()
+    return found
+
+
+def find_reusable_session(content_hash, exclude_session_id, embedding_model, embedding_dim):
+    """Return a session whose collection still holds chunks for this file content, or None.
+
+    Only sessions whose vectors came from the same embedding model and dimension qualify;
+    rows recorded before the model was tracked are never reused.
+    """
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT d.session_id FROM ingested_documents d
+                JOIN langchain_pg_collection c ON c.name = 'session_' || d.session_id
+                WHERE d.content_hash=%s AND d.session_id <> %s
+                  AND d.embedding_model = %s AND d.embedding_dim = %s
+                  AND EXISTS (
+                      SELECT 1 FROM langchain_pg_embedding e
+                      WHERE e.collection_id = c.uuid AND e.cmetadata->>'content_hash' = %s
+                  )
+                ORDER BY d.created_at DESC LIMIT 1
+                """,
+                (content_hash, exclude_session_id, embedding_model, embedding_dim, content_hash),
+            )
+            row = cur.fetchone()
+    conn.close()
+    return row[0] if row else None
+
+
+def link_document_chunks(content_hash, source_session_id, target_session_id, source_file, source_path, embedding_dim):
+    """Copy parsed chunks and their embeddings for a known file into another session.
+
+    The target collection must already exist (get_vectorstore creates it).
+    Rows whose vector dimension differs from embedding_dim are not copied.
+    Returns the number of chunks linked.
+    """
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            source_collection = get_collection_id(cur, source_session_id)
+            target_collection = get_collection_id(cur, target_session_id)
+            if source_collection is None or target_collection is None:
+                linked = 0
+            else:
+                cur.execute(
+                    """
+                    INSERT INTO langchain_pg_embedding (id, collection_id, embedding, document, cmetadata)
+                    SELECT gen_random_uuid()::text, %s, e.embedding, e.document,
+                           e.cmetadata || jsonb_build_object('source_file', %s::text, 'source_path', %s::text)
+                    FROM langchain_pg_embedding e
+                    WHERE e.collection_id = %s AND e.cmetadata->>'content_hash' = %s
+                      AND vector_dims(e.embedding) = %s
+                    """,
+                    (target_collection, source_file, source_path, source_collection, content_hash, embedding_dim),
+                )
+                linked = cur.rowcount
+    conn.close()
+    return linked
+
+
+def record_document(content_hash, session_id, source_file, source_path, chunk_count, embedding_model=None, embedding_dim=None):
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO ingested_documents (content_hash, session_id, source_file, source_path, chunk_count, embedding_model, embedding_dim)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (content_hash, session_id) DO UPDATE
+                SET source_file=EXCLUDED.source_file, source_path=EXCLUDED.source_path, chunk_count=EXCLUDED.chunk_count,
+                    embedding_model=EXCLUDED.embedding_model, embedding_dim=EXCLUDED.embedding_dim
+                """,
+                (content_hash, session_id, source_file, os.path.abspath(source_path), chunk_count, embedding_model, embedding_dim),
+            )
+    conn.close()
+
+
+def delete_document_chunks(session_id, content_hash):
+    """Remove a file's chunks from a session collection, e.g. after a failed ingest."""
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            collection_id = get_collection_id(cur, session_id)
+            deleted = 0
+            if collection_id is not None:
+                cur.execute(
+                    "DELETE FROM langchain_pg_embedding WHERE collection_id=%s AND cmetadata->>'content_hash'=%s",
+                    (collection_id, content_hash),
+                )
+                deleted = cur.rowcount
+    conn.close()
+    return deleted
@@ -0,0 +1,111 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+
+load_dotenv()
+
+# DashScope text-embedding 单次请求最多 25 条文本
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "25"))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "2"))
+
+_metrics_lock = threading.Lock()
+_metrics = {
+    "chunks": 0,
+    "batches": 0,
+    "retries": 0,
+    "failed_batches": 0,
+    "seconds": 0.0,
+    "last": None,
+}
+# 进程内共享的线程池，限制所有调用方对 embedding 服务的总并发
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=EMBEDDING_MAX_CONCURRENCY, thread_name_prefix="embed")
+        return _executor
+
+
+def get_embedding_metrics():
+    """Cumulative and last-call embedding throughput (chunks/s) for this process."""
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    metrics["chunks_per_s"] = round(metrics["chunks"] / metrics["seconds"], 2) if metrics["seconds"] else None
+    metrics.update({"batch_size": EMBEDDING_BATCH_SIZE, "max_concurrency": EMBEDDING_MAX_CONCURRENCY})
+    return metrics
+
+
+class BatchedEmbeddings(Embeddings):
+    """Split texts into fixed-size batches and embed them concurrently with per-batch retries."""
+
+    def __init__(self, underlying, batch_size=None, max_retries=None):
+        self.underlying = underlying
+        self.batch_size = batch_size or EMBEDDING_BATCH_SIZE
+        self.max_retries = EMBEDDING_MAX_RETRIES if max_retries is None else max_retries
+
+    def _call_with_retries(self, texts):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.underlying.embed_documents(texts)
+            except Exception:
+                if attempt == self.max_retries:
+                    raise
+                with _metrics_lock:
+                    _metrics["retries"] += 1
+                time.sleep(0.5 * (2 ** attempt))
+
+    def _embed_batch(self, texts):
+        try:
+            return self._call_with_retries(texts)
+        except Exception as e:
+            if len(texts) == 1:
+                raise
+            # 整批失败时逐条重试，定位并隔离出问题的文本
+            print(f"embedding 批次失败({len(texts)} 条)，逐条重试: {e}")
+            with _metrics_lock:
+                _metrics["failed_batches"] += 1
+            return [self._call_with_retries([t])[0] for t in texts]
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+        started = time.perf_counter()
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1:
+            results = [self._embed_batch(batches[0])]
+        else:
+            executor = _get_executor()
+            results = [f.result() for f in [executor.submit(self._embed_batch, b) for b in batches]]
+        vectors = [vec for batch in results for vec in batch]
+        elapsed = time.perf_counter() - started
+        with _metrics_lock:
+            _metrics["chunks"] += len(texts)
+            _metrics["batches"] += len(batches)
+            _metrics["seconds"] += elapsed
+            _metrics["last"] = {
+                "chunks": len(texts),
+                "batches": len(batches),
+                "seconds": round(elapsed, 3),
+                "chunks_per_s": round(len(texts) / elapsed, 2) if elapsed else None,
+            }
+        return vectors
+
+    def embed_query(self, text):
+        return self.underlying.embed_query(text)
+
+    def embed_queries(self, texts):
+        """Embed several queries concurrently, keeping query-typed embeddings from the provider."""
+        texts = list(texts)
+        if len(texts) <= 1:
+            return [self.underlying.embed_query(t) for t in texts]
+        executor = _get_executor()
+        return [f.result() for f in [executor.submit(self.underlying.embed_query, t) for t in texts]]
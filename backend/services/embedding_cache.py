@@ -0,0 +1,331 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from db.db import get_conn
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+
+load_dotenv()
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "1") not in ("0", "false", "False")
+# 超过该行数时按 last_used_at 淘汰最久未使用的向量
+EMBEDDING_CACHE_MAX_ROWS = int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", "500000"))
+# 每写入多少条新向量检查一次是否需要淘汰
+EMBEDDING_CACHE_EVICT_EVERY = int(os.getenv("EMBEDDING_CACHE_EVICT_EVERY", "1000"))
+
+# 查询向量缓存：进程内 LRU（条数上限 + TTL），未命中再查持久化表
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "4096"))
+QUERY_CACHE_TTL_SECONDS = int(os.getenv("QUERY_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "writes": 0, "evicted": 0, "errors": 0}
+_query_memory = OrderedDict()
+_query_stats = {"memory_hits": 0, "persistent_hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+_table_ready = False
+_writes_since_evict = 0
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _bump(**counts):
+    with _stats_lock:
+        for k, v in counts.items():
+            _stats[k] += v
+
+
+def ensure_cache_table():
+    global _table_ready
+    if _table_ready:
+        return
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    model VARCHAR(128) NOT NULL,
+                    text_hash VARCHAR(64) NOT NULL,
+                    embedding REAL[] NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (model, text_hash)
+                )
+                """
+            )
+            cur.execute("CREATE INDEX IF NOT EXISTS ix_embedding_cache_last_used ON embedding_cache (last_used_at)")
+    conn.close()
+    _table_ready = True
+
+
+def lookup_embeddings(model, hashes, max_age_s=None):
+    """Return {text_hash: vector} for cached entries and refresh their last_used_at.
+
+    max_age_s: ignore entries created longer ago than this (used for query TTL).
+    """
+    if not hashes:
+        return {}
+    ensure_cache_table()
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            sql = (
+                "UPDATE embedding_cache SET hits=hits + 1, last_used_at=CURRENT_TIMESTAMP "
+                "WHERE model=%s AND text_hash = ANY(%s)"
+            )
+            params = [model, list(hashes)]
+            if max_age_s:
+                sql += " AND created_at > CURRENT_TIMESTAMP - make_interval(secs => %s)"
+                params.append(max_age_s)
+            cur.execute(sql + " RETURNING text_hash, embedding", params)
+            rows = cur.fetchall()
+    conn.close()
+    return {h: list(vec) for h, vec in rows}
+
+
+def store_embeddings(model, items, refresh=False):
+    """Persist [(text_hash, vector)] pairs, then evict old rows if the cache grew too large.
+
+    refresh: overwrite existing rows and reset created_at (used when a TTL expired).
+    """
+    global _writes_since_evict
+    if not items:
+        return
+    ensure_cache_table()
+    from psycopg2.extras import execute_values
+    conflict = (
+        "DO UPDATE SET embedding=EXCLUDED.embedding, created_at=CURRENT_TIMESTAMP, last_used_at=CURRENT_TIMESTAMP"
+        if refresh else "DO NOTHING"
+    )
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            execute_values(
+                cur,
+                f"INSERT INTO embedding_cache (model, text_hash, embedding) VALUES %s ON CONFLICT (model, text_hash) {conflict}",
+                [(model, h, list(vec)) for h, vec in items],
+            )
+    conn.close()
+    _bump(writes=len(items))
+    with _stats_lock:
+        _writes_since_evict += len(items)
+        should_evict = _writes_since_evict >= EMBEDDING_CACHE_EVICT_EVERY
+        if should_evict:
+            _writes_since_evict = 0
+    if should_evict:
+        evict_embeddings()
+
+
+def evict_embeddings(max_rows=None):
+    """Delete least-recently-used rows beyond max_rows. Returns the number deleted."""
+    max_rows = EMBEDDING_CACHE_MAX_ROWS if max_rows is None else max_rows
+    ensure_cache_table()
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM embedding_cache")
+            overflow = cur.fetchone()[0] - max_rows
+            deleted = 0
+            if overflow > 0:
+                cur.execute(
+                    """
+                    DELETE FROM embedding_cache WHERE (model, text_hash) IN (
+                        SELECT model, text_hash FROM embedding_cache ORDER BY last_used_at LIMIT %s
+                    )
+                    """,
+                    (overflow,),
+                )
+                deleted = cur.rowcount
+    conn.close()
+    if deleted:
+        _bump(evicted=deleted)
+        print(f"embedding 缓存淘汰 {deleted} 条")
+    return deleted
+
+
+def _query_memory_get(key):
+    now = time.monotonic()
+    with _stats_lock:
+        entry = _query_memory.get(key)
+        if entry is None:
+            return None
+        vector, stored_at = entry
+        if now - stored_at > QUERY_CACHE_TTL_SECONDS:
+            del _query_memory[key]
+            _query_stats["expired"] += 1
+            return None
+        _query_memory.move_to_end(key)
+        _query_stats["memory_hits"] += 1
+        return vector
+
+
+def _query_memory_put(key, vector):
+    with _stats_lock:
+        _query_memory[key] = (vector, time.monotonic())
+        _query_memory.move_to_end(key)
+        while len(_query_memory) > QUERY_CACHE_MAX_ENTRIES:
+            _query_memory.popitem(last=False)
+            _query_stats["evicted"] += 1
+
+
+def get_query_cache_stats():
+    with _stats_lock:
+        stats = dict(_query_stats)
+        stats["entries"] = len(_query_memory)
+    total = stats["memory_hits"] + stats["persistent_hits"] + stats["misses"]
+    stats["hit_rate"] = round((stats["memory_hits"] + stats["persistent_hits"]) / total, 4) if total else None
+    stats.update({"max_entries": QUERY_CACHE_MAX_ENTRIES, "ttl_seconds": QUERY_CACHE_TTL_SECONDS})
+    return stats
+
+
+def get_cache_stats():
+    """Process-local hit/miss counters plus table-level size information."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["query"] = get_query_cache_stats()
+    total = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / total, 4) if total else None
+    try:
+        ensure_cache_table()
+        conn = get_conn()
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT count(*), coalesce(sum(hits), 0) FROM embedding_cache")
+                rows, lifetime_hits = cur.fetchone()
+                cur.execute("SELECT pg_total_relation_size('embedding_cache')")
+                size_bytes = cur.fetchone()[0]
+        conn.close()
+        stats.update({"rows": rows, "lifetime_hits": int(lifetime_hits), "size_bytes": size_bytes, "max_rows": EMBEDDING_CACHE_MAX_ROWS})
+    except Exception as e:
+        stats["table_error"] = str(e)
+    return stats
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that consults the embedding_cache table before calling the provider."""
+
+    def __init__(self, underlying, model_name):
+        self.underlying = underlying
+        self.model_name = model_name
+        # 部分模型对 query/document 使用不同的 text_type，查询向量单独缓存
+        self.query_model_name = f"{model_name}:query"
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        if not texts or not EMBEDDING_CACHE_ENABLED:
+            return self.underlying.embed_documents(texts)
+        hashes = [text_hash(t) for t in texts]
+        try:
+            cached = lookup_embeddings(self.model_name, set(hashes))
+        except Exception as e:
+            print(f"embedding 缓存读取失败: {e}")
+            _bump(errors=1)
+            return self.underlying.embed_documents(texts)
+
+        # 同一批次中重复文本只请求一次
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in cached and h not in missing:
+                missing[h] = t
+        _bump(hits=len(texts) - sum(1 for h in hashes if h in missing), misses=sum(1 for h in hashes if h in missing))
+
+        if missing:
+            miss_hashes = list(missing.keys())
+            vectors = self.underlying.embed_documents([missing[h] for h in miss_hashes])
+            fresh = list(zip(miss_hashes, vectors))
+            cached.update(fresh)
+            try:
+                store_embeddings(self.model_name, fresh)
+            except Exception as e:
+                print(f"embedding 缓存写入失败: {e}")
+                _bump(errors=1)
+        return [cached[h] for h in hashes]
+
+    def embed_query(self, text):
+        """Query embedding via in-process LRU, then the persistent table (both with TTL), then the provider."""
+        if not EMBEDDING_CACHE_ENABLED:
+            return self.underlying.embed_query(text)
+        h = text_hash(text)
+        memory_key = (self.query_model_name, h)
+        vector = _query_memory_get(memory_key)
+        if vector is not None:
+            _bump(hits=1)
+            return vector
+        try:
+            cached = lookup_embeddings(self.query_model_name, [h], max_age_s=QUERY_CACHE_TTL_SECONDS)
+        except Exception as e:
+            print(f"embedding 缓存读取失败: {e}")
+            _bump(errors=1)
+            cached = None
+        if cached and h in cached:
+            _bump(hits=1)
+            with _stats_lock:
+                _query_stats["persistent_hits"] += 1
+            _query_memory_put(memory_key, cached[h])
+            return cached[h]
+        _bump(misses=1)
+        with _stats_lock:
+            _query_stats["misses"] += 1
+        vector = self.underlying.embed_query(text)
+        _query_memory_put(memory_key, vector)
+        if cached is not None:
+            try:
+                store_embeddings(self.query_model_name, [(h, vector)], refresh=True)
+            except Exception as e:
+                print(f"embedding 缓存写入失败: {e}")
+                _bump(errors=1)
+        return vector
+
+    def embed_queries(self, texts):
+        """Embed several queries: in-process and persistent lookups are batched, misses embedded together."""
+        texts = list(texts)
+        if not EMBEDDING_CACHE_ENABLED:
+            return self._underlying_embed_queries(texts)
+        hashes = [text_hash(t) for t in texts]
+        vectors = {}
+        for h in hashes:
+            vector = _query_memory_get((self.query_model_name, h))
+            if vector is not None:
+                vectors[h] = vector
+        _bump(hits=len(vectors))
+        pending = [h for h in dict.fromkeys(hashes) if h not in vectors]
+        persistent_ok = True
+        if pending:
+            try:
+                found = lookup_embeddings(self.query_model_name, pending, max_age_s=QUERY_CACHE_TTL_SECONDS)
+            except Exception as e:
+                print(f"embedding 缓存读取失败: {e}")
+                _bump(errors=1)
+                found, persistent_ok = {}, False
+            for h, vector in found.items():
+                vectors[h] = vector
+                _query_memory_put((self.query_model_name, h), vector)
+            _bump(hits=len(found))
+            with _stats_lock:
+                _query_stats["persistent_hits"] += len(found)
+        missing = [h for h in pending if h not in vectors]
+        if missing:
+            text_by_hash = dict(zip(hashes, texts))
+            fresh = list(zip(missing, self._underlying_embed_queries([text_by_hash[h] for h in missing])))
+            _bump(misses=len(missing))
+            with _stats_lock:
+                _query_stats["misses"] += len(missing)
+            for h, vector in fresh:
+                vectors[h] = vector
+                _query_memory_put((self.query_model_name, h), vector)
+            if persistent_ok:
+                try:
+                    store_embeddings(self.query_model_name, fresh, refresh=True)
+                except Exception as e:
+                    print(f"embedding 缓存写入失败: {e}")
+                    _bump(errors=1)
+        return [vectors[h] for h in hashes]
+
+    def _underlying_embed_queries(self, texts):
+        if hasattr(self.underlying, "embed_queries"):
+            return self.underlying.embed_queries(texts)
+        return [self.underlying.embed_query(t) for t in texts]
@@ -0,0 +1,73 @@
+import os
+import hashlib
+from dotenv import load_dotenv
+
+load_dotenv()
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "/tmp")
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# 0 表示不限制单个文件大小
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", "0"))
+
+
+class UploadTooLarge(Exception):
+    """Raised when an uploaded file exceeds the configured size limit."""
+
+
+def build_upload_path(session_id, filename, unique_id):
+    safe_name = os.path.basename(filename or "unknown")
+    return os.path.join(UPLOAD_DIR, f"{session_id}_{unique_id}_{safe_name}")
+
+
+def remove_files(paths):
+    """Best-effort removal of files saved earlier in a request that is being rejected."""
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+async def save_upload_stream(uploaded_file, file_path, chunk_size=None, max_bytes=None):
+    """Stream an UploadFile to disk with a fixed-size buffer.
+
+    Returns (size_in_bytes, sha256_hex). The partially written file is removed
+    when the size limit is exceeded or the write fails.
+    """
+    chunk_size = chunk_size or UPLOAD_CHUNK_SIZE
+    max_bytes = UPLOAD_MAX_BYTES if max_bytes is None else max_bytes
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(file_path, "wb") as f:
+            while True:
+                chunk = await uploaded_file.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise UploadTooLarge(f"{os.path.basename(file_path)} 超过大小限制 {max_bytes} 字节")
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+        raise
+    finally:
+        await uploaded_file.close()
+    return size, digest.hexdigest()
+
+
+def file_sha256(file_path, chunk_size=None):
+    """Compute the SHA-256 of a file on disk with a fixed-size read buffer."""
+    chunk_size = chunk_size or UPLOAD_CHUNK_SIZE
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,209 @@
+import os
+import json
+import uuid
+from db.db import get_conn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 超过该时长未更新的 running 任务视为 worker 已崩溃，可被重新领取
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "1800"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# worker 处理任务期间刷新 updated_at 的间隔，需明显小于 JOB_STALE_SECONDS
+JOB_HEARTBEAT_SECONDS = int(os.getenv("JOB_HEARTBEAT_SECONDS", "60"))
+
+JOB_STAGES = ["ingest", "questionnaire", "kpi_contexts"]
+
+
+def ensure_job_table():
+    """Create the ingest_jobs table when the database predates schema.sql changes."""
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS ingest_jobs (
+                    id VARCHAR(64) PRIMARY KEY,
+                    session_id VARCHAR(128) NOT NULL,
+                    status VARCHAR(32) NOT NULL DEFAULT 'queued',
+                    stage VARCHAR(64),
+                    progress JSONB NOT NULL DEFAULT '{}',
+                    payload JSONB NOT NULL,
+                    result JSONB,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker_id VARCHAR(128),
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    started_at TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    finished_at TIMESTAMP
+                )
+                """
+            )
+            cur.execute("CREATE INDEX IF NOT EXISTS ix_ingest_jobs_status ON ingest_jobs (status, created_at)")
+    conn.close()
+
+
+def enqueue_job(session_id, file_paths, file_infos=None):
+    """Insert a queued ingestion job and return its id."""
+    job_id = uuid.uuid4().hex
+    payload = {"file_paths": file_paths, "files": file_infos or []}
+    progress = {"stages": {stage: {"status": "pending"} for stage in JOB_STAGES}}
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO ingest_jobs (id, session_id, status, payload, progress) VALUES (%s, %s, 'queued', %s, %s)",
+                (job_id, session_id, json.dumps(payload), json.dumps(progress)),
+            )
+    conn.close()
+    return job_id
+
+
+def claim_next_job(worker_id):
+    """Atomically claim the oldest runnable job using FOR UPDATE SKIP LOCKED.
+
+    Returns (job_id, session_id, payload) or None when the queue is empty.
+    """
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            # 重试次数已用完的超时任务不会再被领取，直接标记失败
+            cur.execute(
+                """
+                UPDATE ingest_jobs
+                SET status='failed', error=COALESCE(error, 'worker 超时未响应，重试次数已用完'),
+                    updated_at=CURRENT_TIMESTAMP, finished_at=CURRENT_TIMESTAMP
+                WHERE status='running' AND attempts >= %s
+                  AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                """,
+                (JOB_MAX_ATTEMPTS, JOB_STALE_SECONDS),
+            )
+            cur.execute(
+                """
+                UPDATE ingest_jobs
+                SET status='running', worker_id=%s, attempts=attempts + 1,
+                    started_at=CURRENT_TIMESTAMP, updated_at=CURRENT_TIMESTAMP
+                WHERE id = (
+                    SELECT id FROM ingest_jobs
+                    WHERE attempts < %s AND (
+                        status='queued'
+                        OR (status='running' AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+                    )
+                    ORDER BY created_at
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING id, session_id, payload
+                """,
+                (worker_id, JOB_MAX_ATTEMPTS, JOB_STALE_SECONDS),
+            )
+            row = cur.fetchone()
+    conn.close()
+    if not row:
+        return None
+    job_id, session_id, payload = row
+    if isinstance(payload, str):
+        payload = json.loads(payload)
+    return job_id, session_id, payload
+
+
+def update_job_progress(job_id, stage, status="running", **detail):
+    """Record stage-level progress. Entering a stage marks earlier stages as done."""
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT progress FROM ingest_jobs WHERE id=%s FOR UPDATE", (job_id,))
+            row = cur.fetchone()
+            if row:
+                progress = row[0] or {}
+                if isinstance(progress, str):
+                    progress = json.loads(progress)
+                stages = progress.setdefault("stages", {})
+                if stage in JOB_STAGES:
+                    for earlier in JOB_STAGES[:JOB_STAGES.index(stage)]:
+                        if stages.get(earlier, {}).get("status") != "done":
+                            stages[earlier] = {**stages.get(earlier, {}), "status": "done"}
+                entry = dict(stages.get(stage, {}))
+                entry["status"] = status
+                entry.update(detail)
+                stages[stage] = entry
+                cur.execute(
+                    "UPDATE ingest_jobs SET stage=%s, progress=%s, updated_at=CURRENT_TIMESTAMP WHERE id=%s",
+                    (stage, json.dumps(progress, ensure_ascii=False), job_id),
+                )
+    conn.close()
+
+
+def touch_job(job_id, worker_id):
+    """Heartbeat: refresh updated_at while this worker still owns the running job. Returns False once it lost the job."""
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE ingest_jobs SET updated_at=CURRENT_TIMESTAMP WHERE id=%s AND worker_id=%s AND status='running'",
+                (job_id, worker_id),
+            )
+            owned = cur.rowcount > 0
+    conn.close()
+    return owned
+
+
+def complete_job(job_id, result, worker_id):
+    """Mark the job done; ignored (returns False) when another worker has reclaimed it."""
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT progress FROM ingest_jobs WHERE id=%s AND worker_id=%s FOR UPDATE", (job_id, worker_id))
+            row = cur.fetchone()
+            progress = (row[0] if row else None) or {}
+            if isinstance(progress, str):
+                progress = json.loads(progress)
+            for stage in JOB_STAGES:
+                progress.setdefault("stages", {}).setdefault(stage, {})["status"] = "done"
+            cur.execute(
+                "UPDATE ingest_jobs SET status='done', stage=NULL, progress=%s, result=%s, "
+                "updated_at=CURRENT_TIMESTAMP, finished_at=CURRENT_TIMESTAMP WHERE id=%s AND worker_id=%s",
+                (json.dumps(progress, ensure_ascii=False), json.dumps(result, ensure_ascii=False, default=str), job_id, worker_id),
+            )
+            owned = cur.rowcount > 0
+    conn.close()
+    return owned
+
+
+def fail_job(job_id, error, worker_id):
+    """Mark a job failed, or requeue it while attempts remain; ignored when another worker owns it."""
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE ingest_jobs SET status=CASE WHEN attempts < %s THEN 'queued' ELSE 'failed' END, "
+                "error=%s, updated_at=CURRENT_TIMESTAMP, "
+                "finished_at=CASE WHEN attempts < %s THEN NULL ELSE CURRENT_TIMESTAMP END "
+                "WHERE id=%s AND worker_id=%s",
+                (JOB_MAX_ATTEMPTS, str(error), JOB_MAX_ATTEMPTS, job_id, worker_id),
+            )
+            owned = cur.rowcount > 0
+    conn.close()
+    return owned
+
+
+def get_job(job_id):
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT id, session_id, status, stage, progress, result, error, attempts, created_at, started_at, finished_at "
+                "FROM ingest_jobs WHERE id=%s",
+                (job_id,),
+            )
+            row = cur.fetchone()
+    conn.close()
+    if not row:
+        return None
+    keys = ["job_id", "session_id", "status", "stage", "progress", "result", "error", "attempts", "created_at", "started_at", "finished_at"]
+    job = dict(zip(keys, row))
+    for k in ("created_at", "started_at", "finished_at"):
+        if job[k] is not None:
+            job[k] = job[k].isoformat()
+    return job
@@ -0,0 +1,303 @@
+import os
+import re
+from db.db import get_conn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 入库时从文本/表格中抽取“指标名 + 数值 + 单位”候选，问卷数值题优先查表，未命中再走 LLM/VL
+KPI_INDEX_ENABLED = os.getenv("KPI_INDEX_ENABLED", "1") == "1"
+# 指标名之后多少个字符内寻找数值
+KPI_MAX_GAP = int(os.getenv("KPI_MAX_GAP", "80"))
+# 每个指标最多使用的候选数（多于一个且数值不同时记为冲突）
+KPI_MAX_CANDIDATES = int(os.getenv("KPI_MAX_CANDIDATES", "3"))
+# 最佳候选置信度不低于该值、且其他高置信候选与之一致时才直接作为答案，否则仅作为 LLM 提示
+KPI_MIN_CONFIDENCE = float(os.getenv("KPI_MIN_CONFIDENCE", "0.8"))
+
+KPI_LABELS = {
+    "scope1": r"scope\s*1|范围\s*[一1]|直接(?:温室气体)?排放",
+    "scope2": r"scope\s*2|范围\s*[二2]|(?<!其他)(?:能源)?间接(?:温室气体)?排放",
+    "scope3": r"scope\s*3|范围\s*[三3]|其他间接(?:温室气体)?排放|价值链排放",
+    "energy_total": r"总能耗|综合能(?:源消)?耗|能源消耗总量|能源总消耗|total energy consumption",
+    "renewable_ratio": r"可再生能源(?:使用)?(?:占比|比例|比重)|renewable energy (?:share|ratio|percentage)",
+    "hazardous_waste": r"(?<![非无一])(?:有害|危险)(?:废弃物|废物)|(?<!non-)(?<!non )hazardous waste",
+    "nonhazardous_waste": r"(?:无害|一般|非危险)(?:废弃物|废物|固废)|一般固体废物|non-?hazardous waste",
+    "recycled_waste": r"(?:回收|再利用|综合利用)的?(?:废弃物|废物)?总?量|废弃物回收(?:利用)?量|recycled waste",
+}
+KPI_CATEGORY = {
+    "scope1": "emission",
+    "scope2": "emission",
+    "scope3": "emission",
+    "energy_total": "energy",
+    "renewable_ratio": "ratio",
+    "hazardous_waste": "waste",
+    "nonhazardous_waste": "waste",
+    "recycled_waste": "waste",
+}
+# 规范化单位 -> (类别, 换算到问卷单位的系数)；问卷单位：排放 吨CO2e，能耗 kWh，废弃物 kg，比例 %
+UNITS = {
+    "tco2e": ("emission", 1.0),
+    "tco2": ("emission", 1.0),
+    "吨二氧化碳当量": ("emission", 1.0),
+    "吨co2e": ("emission", 1.0),
+    "吨co2当量": ("emission", 1.0),
+    "kgco2e": ("emission", 0.001),
+    "千克二氧化碳当量": ("emission", 0.001),
+    "kwh": ("energy", 1.0),
+    "千瓦时": ("energy", 1.0),
+    "度": ("energy", 1.0),
+    "mwh": ("energy", 1e3),
+    "兆瓦时": ("energy", 1e3),
+    "gwh": ("energy", 1e6),
+    "吉瓦时": ("energy", 1e6),
+    "gj": ("energy", 1e9 / 3.6e6),
+    "吉焦": ("energy", 1e9 / 3.6e6),
+    "tj": ("energy", 1e12 / 3.6e6),
+    "太焦": ("energy", 1e12 / 3.6e6),
+    "kg": ("waste", 1.0),
+    "千克": ("waste", 1.0),
+    "公斤": ("waste", 1.0),
+    "%": ("ratio", 1.0),
+}
+# 裸“吨/t”：排放题按吨CO2e，废弃物题按 1000 kg
+MASS_TONNE = {"emission": 1.0, "waste": 1000.0}
+MAGNITUDES = {"万": 1e4, "亿": 1e8, "千": 1e3}
+
+_VALUE = re.compile(
+    r"(?P<num>\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)\s*(?P<mag>[万亿千])?\s*"
+    r"(?P<unit>tco[2₂]-?e|tco[2₂]|吨二氧化碳当量|吨co[2₂]-?e|吨co[2₂]当量|kgco[2₂]-?e|千克二氧化碳当量|"
+    r"kwh|千瓦时|mwh|兆瓦时|gwh|吉瓦时|gj|吉焦|tj|太焦|kg|千克|公斤|%|"
+    r"吨(?!标准煤|标煤|标油)|t(?![a-z]))"
+    # 强度指标（tCO2e/t、吨CO2e/万元）：回溯到较短单位时后面仍跟着单位残余与 /，一并排除
+    r"(?![A-Za-z0-9₂]*\s*[/每])",
+    re.IGNORECASE,
+)
+_DEGREE = re.compile(r"(?P<num>\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)\s*(?P<mag>[万亿])\s*(?P<unit>度)(?![A-Za-z0-9₂]*\s*[/每])")
+_LABEL_PATTERNS = {key: re.compile(pattern, re.IGNORECASE) for key, pattern in KPI_LABELS.items()}
+_ANY_LABEL = re.compile("|".join(f"(?:{p})" for p in KPI_LABELS.values()), re.IGNORECASE)
+# 变化量（较上年减少 3,000 吨、由 20% 提升至 35%）不是指标值
+_CHANGE = re.compile(r"增加|减少|下降|上升|提升|提高|降低|降至|升至|增至|增长|同比|较上年|较去年|变化|变动|由|从|[+＋]")
+# 合计口径（范围1+范围2、范围一及范围二）不能归到单个范围
+_COMBINED_AFTER = re.compile(r"^\s*(?:[+＋&和与及、/]|以及)\s*(?:范围|scope|[一二三123](?!\d))", re.IGNORECASE)
+_COMBINED_BEFORE = re.compile(r"(?:范围|scope)\s*[一二三123]\s*(?:[+＋&和与及、/]|以及)\s*$", re.IGNORECASE)
+
+
+def ensure_kpi_table():
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS kpi_candidates (
+                    id SERIAL PRIMARY KEY,
+                    content_hash VARCHAR(64) NOT NULL,
+                    kpi_key VARCHAR(64) NOT NULL,
+                    value DOUBLE PRECISION NOT NULL,
+                    unit VARCHAR(32),
+                    raw_text TEXT,
+                    label TEXT,
+                    page INTEGER,
+                    source_type VARCHAR(16),
+                    snippet TEXT,
+                    confidence REAL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+                """
+            )
+            cur.execute("CREATE INDEX IF NOT EXISTS ix_kpi_candidates_hash_key ON kpi_candidates (content_hash, kpi_key)")
+    conn.close()
+
+
+def _normalize_unit(unit):
+    return unit.lower().replace("₂", "2").replace("-", "")
+
+
+def _convert(match, category):
+    """Value converted to the questionnaire unit for a category, or None when the unit does not fit."""
+    unit = _normalize_unit(match.group("unit"))
+    if unit in ("吨", "t"):
+        factor = MASS_TONNE.get(category)
+    else:
+        unit_category, factor = UNITS.get(unit, (None, None))
+        if unit_category != category:
+            return None
+    if factor is None:
+        return None
+    value = float(match.group("num").replace(",", ""))
+    mag = match.group("mag")
+    if mag:
+        value *= MAGNITUDES[mag]
+    return value * factor
+
+
+def _is_combined(line, label):
+    return bool(_COMBINED_AFTER.match(line[label.end():label.end() + 12]) or _COMBINED_BEFORE.search(line[max(0, label.start() - 12):label.start()]))
+
+
+def extract_kpi_candidates(text, page=None, source_type="text"):
+    """Scan text line by line for KPI label -> number + unit pairs.
+
+    Returns [{kpi_key, value, unit, raw_text, label, page, source_type, snippet, confidence}],
+    with values converted to the questionnaire units. Changes, combined scope totals and
+    intensities are skipped; several values after one label (multi-year rows) are all
+    kept at reduced confidence.
+    """
+    candidates = []
+    for line in (text or "").splitlines():
+        if not any(ch.isdigit() for ch in line):
+            continue
+        for key, pattern in _LABEL_PATTERNS.items():
+            category = KPI_CATEGORY[key]
+            for label in pattern.finditer(line):
+                if _is_combined(line, label):
+                    continue
+                window = line[label.end():label.end() + KPI_MAX_GAP]
+                matches = list(_VALUE.finditer(window))
+                if category == "energy":
+                    matches += list(_DEGREE.finditer(window))
+                    matches.sort(key=lambda m: m.start())
+                found = []
+                for m in matches:
+                    prefix = window[:m.start()]
+                    if _ANY_LABEL.search(prefix):
+                        # 已进入下一个指标的范围
+                        break
+                    if _CHANGE.search(prefix[-12:]):
+                        continue
+                    value = _convert(m, category)
+                    if value is None:
+                        continue
+                    confidence = 1.0 - m.start() / (2.0 * KPI_MAX_GAP)
+                    if source_type == "table":
+                        confidence = min(1.0, confidence + 0.1)
+                    found.append((m, value, confidence))
+                # 多个不同数值（如多年度列）无法确定对应年份，降低置信度交给 LLM 判断
+                ambiguous = len({round(value, 6) for _, value, _ in found}) > 1
+                for m, value, confidence in found:
+                    if ambiguous:
+                        confidence *= 0.5
+                    candidates.append({
+                        "kpi_key": key,
+                        "value": value,
+                        "unit": m.group("unit"),
+                        "raw_text": m.group(0).strip(),
+                        "label": label.group(0),
+                        "page": page,
+                        "source_type": source_type,
+                        "snippet": line.strip()[:200],
+                        "confidence": round(confidence, 3),
+                    })
+    return candidates
+
+
+def extract_from_documents(docs):
+    """Candidates from ingested chunks; chunk overlap duplicates are dropped."""
+    results = []
+    for d in docs:
+        page = d.metadata.get("page")
+        try:
+            page = int(page) if page is not None else None
+        except (TypeError, ValueError):
+            page = None
+        results.extend(extract_kpi_candidates(d.page_content, page=page, source_type=d.metadata.get("type") or "text"))
+    return results
+
+
+def extract_from_artifact_tables(file_path, content_hash):
+    """Candidates from the pdfplumber tables stored in the parsed-document artifact, one row per line."""
+    from services.parsed_document import iter_document_pages
+    results = []
+    for page in iter_document_pages(file_path, content_hash=content_hash):
+        for table in page.get("tables") or []:
+            text = "\n".join(" ".join(str(cell) for cell in row if cell) for row in table if row)
+            results.extend(extract_kpi_candidates(text, page=page["page"], source_type="table"))
+    return results
+
+
+def _dedupe(candidates):
+    best = {}
+    for c in candidates:
+        key = (c["kpi_key"], c["page"], round(c["value"], 6))
+        if key not in best or c["confidence"] > best[key]["confidence"]:
+            best[key] = c
+    return list(best.values())
+
+
+def store_kpi_candidates(content_hash, candidates):
+    """Replace the KPI candidates for a file content hash. Returns the number stored."""
+    from psycopg2.extras import execute_values
+
+    candidates = _dedupe(candidates)
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM kpi_candidates WHERE content_hash=%s", (content_hash,))
+            if candidates:
+                execute_values(
+                    cur,
+                    """
+                    INSERT INTO kpi_candidates
+                        (content_hash, kpi_key, value, unit, raw_text, label, page, source_type, snippet, confidence)
+                    VALUES %s
+                    """,
+                    [
+                        (content_hash, c["kpi_key"], c["value"], c["unit"], c["raw_text"], c["label"],
+                         c["page"], c["source_type"], c["snippet"], c["confidence"])
+                        for c in candidates
+                    ],
+                )
+    conn.close()
+    return len(candidates)
+
+
+def is_confident(candidates):
+    """True when the best candidate can answer directly: confident enough and no other confident candidate disagrees."""
+    if not candidates or candidates[0]["confidence"] < KPI_MIN_CONFIDENCE:
+        return False
+    best = candidates[0]["value"]
+    return all(
+        abs(c["value"] - best) <= 1e-6 * max(1.0, abs(best))
+        for c in candidates[1:]
+        if c["confidence"] >= KPI_MIN_CONFIDENCE
+    )
+
+
+def format_hints(candidates):
+    """Prompt text listing index candidates for the LLM to verify against the retrieved content."""
+    lines = []
+    for c in candidates:
+        page = f" 第{c['page'] + 1}页" if c["page"] is not None else ""
+        lines.append(f"- {c['value']:g}（{c['source_file']}{page}：{c['snippet']}）")
+    return "入库时规则抽取的候选值（可能有误，须以内容为准，不要直接照抄）：\n" + "\n".join(lines)
+
+
+def lookup_kpi_candidates(session_id, keys=None):
+    """{kpi_key: [candidate]} for every file ingested into the session, best candidates first."""
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT k.kpi_key, k.value, k.unit, k.page, d.source_file, k.confidence, k.snippet
+                FROM kpi_candidates k
+                JOIN ingested_documents d ON d.content_hash = k.content_hash
+                WHERE d.session_id = %s
+                ORDER BY k.kpi_key, k.confidence DESC, k.page
+                """,
+                (session_id,),
+            )
+            rows = cur.fetchall()
+    conn.close()
+    results = {}
+    for kpi_key, value, unit, page, source_file, confidence, snippet in rows:
+        if keys is not None and kpi_key not in keys:
+            continue
+        results.setdefault(kpi_key, []).append({
+            "value": value,
+            "unit": unit,
+            "page": page,
+            "source_file": source_file,
+            "confidence": confidence,
+            "snippet": snippet,
+        })
+    return results
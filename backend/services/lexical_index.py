@@ -0,0 +1,224 @@
+import os
+import re
+import json
+import math
+import hashlib
+import weakref
+import threading
+from collections import OrderedDict, Counter
+from db.db import get_conn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR") or os.path.join(os.getenv("UPLOAD_DIR", "/tmp"), "lexical_index")
+LEXICAL_CACHE_SIZE = int(os.getenv("LEXICAL_CACHE_SIZE", "16"))
+BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+INDEX_VERSION = 1
+
+_ASCII_TOKEN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+_CJK_RUN = re.compile(r"[一-鿿]+")
+_lock = threading.Lock()
+# 每个会话一把构建锁：冷启动重建某个会话时不阻塞其他会话的检索
+_build_locks = weakref.WeakValueDictionary()
+_indexes = OrderedDict()
+_stats = {"hits": 0, "loads": 0, "builds": 0}
+_jieba = None
+
+
+def _get_jieba():
+    """jieba when installed, else False (char-bigram fallback)."""
+    global _jieba
+    if _jieba is None:
+        try:
+            import jieba
+            jieba.setLogLevel(60)
+            _jieba = jieba
+        except ImportError:
+            _jieba = False
+    return _jieba
+
+
+def tokenizer_name():
+    return "jieba" if _get_jieba() else "bigram"
+
+
+def tokenize(text):
+    """Lowercased search tokens: jieba search-mode words, or CJK char bigrams plus ASCII words/numbers."""
+    text = (text or "").lower()
+    jieba = _get_jieba()
+    if jieba:
+        return [t for t in (w.strip() for w in jieba.lcut_for_search(text)) if any(ch.isalnum() for ch in t)]
+    tokens = _ASCII_TOKEN.findall(text)
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def _index_path(session_id):
+    digest = hashlib.sha1(str(session_id).encode("utf-8")).hexdigest()
+    return os.path.join(LEXICAL_INDEX_DIR, f"{digest}.json")
+
+
+def _collection_signature(session_id):
+    """(row count, id checksum) of the session collection; changes whenever chunks are added or removed."""
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT count(*), coalesce(sum(hashtext(e.id)), 0)
+                FROM langchain_pg_embedding e
+                JOIN langchain_pg_collection c ON c.uuid = e.collection_id
+                WHERE c.name = %s
+                """,
+                (f"session_{session_id}",),
+            )
+            count, checksum = cur.fetchone()
+    conn.close()
+    return [int(count), int(checksum)]
+
+
+def _build_index(session_id, signature):
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT e.id, e.document, e.cmetadata
+                FROM langchain_pg_embedding e
+                JOIN langchain_pg_collection c ON c.uuid = e.collection_id
+                WHERE c.name = %s
+                ORDER BY e.id
+                """,
+                (f"session_{session_id}",),
+            )
+            rows = cur.fetchall()
+    conn.close()
+
+    docs = []
+    doc_len = []
+    postings = {}
+    for i, (doc_id, document, metadata) in enumerate(rows):
+        if isinstance(metadata, str):
+            metadata = json.loads(metadata)
+        docs.append({"id": doc_id, "page_content": document or "", "metadata": metadata or {}})
+        counts = Counter(tokenize(document))
+        doc_len.append(sum(counts.values()))
+        for term, tf in counts.items():
+            postings.setdefault(term, []).append([i, tf])
+    index = {
+        "version": INDEX_VERSION,
+        "tokenizer": tokenizer_name(),
+        "signature": signature,
+        "docs": docs,
+        "doc_len": doc_len,
+        "avg_len": (sum(doc_len) / len(doc_len)) if doc_len else 0.0,
+        "postings": postings,
+    }
+    path = _index_path(session_id)
+    os.makedirs(LEXICAL_INDEX_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return index
+
+
+def _is_current(index, signature):
+    return (
+        index is not None
+        and index.get("version") == INDEX_VERSION
+        and index.get("tokenizer") == tokenizer_name()
+        and index.get("signature") == signature
+    )
+
+
+def _cached(session_id, signature):
+    with _lock:
+        index = _indexes.get(session_id)
+        if _is_current(index, signature):
+            _indexes.move_to_end(session_id)
+            _stats["hits"] += 1
+            return index
+    return None
+
+
+def get_lexical_index(session_id):
+    """Return the session's BM25 index, rebuilding it when the collection has changed since it was built."""
+    signature = _collection_signature(session_id)
+    index = _cached(session_id, signature)
+    if index is not None:
+        return index
+    with _lock:
+        build_lock = _build_locks.get(session_id)
+        if build_lock is None:
+            build_lock = threading.Lock()
+            _build_locks[session_id] = build_lock
+    with build_lock:
+        # 等锁期间可能已由其他线程建好
+        index = _cached(session_id, signature)
+        if index is not None:
+            return index
+        try:
+            with open(_index_path(session_id), "r", encoding="utf-8") as f:
+                index = json.load(f)
+            loaded = True
+        except (OSError, ValueError):
+            index = None
+            loaded = False
+        built = False
+        if not _is_current(index, signature):
+            index = _build_index(session_id, signature)
+            built = True
+            print(f"BM25 索引已重建 session={session_id}: {len(index['docs'])} 个分块, {len(index['postings'])} 个词项")
+        with _lock:
+            _stats["loads"] += int(loaded)
+            _stats["builds"] += int(built)
+            _indexes[session_id] = index
+            _indexes.move_to_end(session_id)
+            while len(_indexes) > LEXICAL_CACHE_SIZE:
+                _indexes.popitem(last=False)
+        return index
+
+
+def bm25_scores(index, query, k):
+    """Top-k [(doc position, score)] for a query against a loaded index."""
+    n_docs = len(index["docs"])
+    if not n_docs:
+        return []
+    avg_len = index["avg_len"] or 1.0
+    doc_len = index["doc_len"]
+    scores = {}
+    for term in set(tokenize(query)):
+        posting = index["postings"].get(term)
+        if not posting:
+            continue
+        idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+        for i, tf in posting:
+            norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * doc_len[i] / avg_len)
+            scores[i] = scores.get(i, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+def bm25_search_batch(session_id, queries, k=10):
+    """Return {query: [Document]} ranked by BM25 over the session's chunks."""
+    from langchain_core.documents import Document
+
+    index = get_lexical_index(session_id)
+    results = {}
+    for q in queries:
+        results[q] = [
+            Document(id=index["docs"][i]["id"], page_content=index["docs"][i]["page_content"], metadata=index["docs"][i]["metadata"])
+            for i, _ in bm25_scores(index, q, k)
+        ]
+    return results
+
+
+def get_lexical_index_stats():
+    with _lock:
+        return {**_stats, "cached": len(_indexes), "tokenizer": tokenizer_name()}
@@ -0,0 +1,110 @@
+import os
+import time
+import threading
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+
+load_dotenv()
+
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "BAAI/bge-small-zh-v1.5")
+# torch: sentence-transformers 默认后端；onnx: onnxruntime 推理
+LOCAL_EMBEDDING_BACKEND = os.getenv("LOCAL_EMBEDDING_BACKEND", "onnx").lower()
+# int8: 导出并使用动态量化的 ONNX 模型（仅 onnx 后端）
+LOCAL_EMBEDDING_QUANTIZE = os.getenv("LOCAL_EMBEDDING_QUANTIZE", "int8").lower()
+# 量化配置对应的 CPU 指令集：avx2 | avx512 | avx512_vnni | arm64
+LOCAL_EMBEDDING_QUANT_ARCH = os.getenv("LOCAL_EMBEDDING_QUANT_ARCH", "avx2")
+LOCAL_EMBEDDING_DIR = os.getenv("LOCAL_EMBEDDING_DIR") or os.path.join(os.getenv("UPLOAD_DIR", "/tmp"), "local_models")
+# 动态批处理：按长度排序后分批，单批最多 MAX_BATCH 条且 条数×最长文本字符数 不超过 MAX_BATCH_CHARS
+LOCAL_EMBEDDING_MAX_BATCH = int(os.getenv("LOCAL_EMBEDDING_MAX_BATCH", "64"))
+LOCAL_EMBEDDING_MAX_BATCH_CHARS = int(os.getenv("LOCAL_EMBEDDING_MAX_BATCH_CHARS", "16000"))
+# bge 系列建议在检索查询前加指令前缀
+LOCAL_EMBEDDING_QUERY_PREFIX = os.getenv("LOCAL_EMBEDDING_QUERY_PREFIX", "为这个句子生成表示以用于检索相关文章：")
+
+
+def dynamic_batches(texts, max_batch=None, max_chars=None):
+    """Group text indices into length-sorted batches so each batch pads to a similar length."""
+    max_batch = max_batch or LOCAL_EMBEDDING_MAX_BATCH
+    max_chars = max_chars or LOCAL_EMBEDDING_MAX_BATCH_CHARS
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    batches = []
+    current = []
+    for i in order:
+        longest = len(texts[i])
+        if current and (len(current) >= max_batch or (len(current) + 1) * longest > max_chars):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _quantized_model_path(model_name):
+    return os.path.join(LOCAL_EMBEDDING_DIR, model_name.replace("/", "__"))
+
+
+def load_sentence_transformer(model_name=None, backend=None, quantize=None):
+    """Load a SentenceTransformer on CPU, exporting an int8 dynamically-quantised ONNX model once when requested."""
+    from sentence_transformers import SentenceTransformer
+
+    model_name = model_name or LOCAL_EMBEDDING_MODEL
+    backend = backend or LOCAL_EMBEDDING_BACKEND
+    quantize = LOCAL_EMBEDDING_QUANTIZE if quantize is None else quantize
+    if backend != "onnx":
+        return SentenceTransformer(model_name, device="cpu"), f"{model_name}:torch"
+    if quantize != "int8":
+        return SentenceTransformer(model_name, device="cpu", backend="onnx"), f"{model_name}:onnx"
+
+    local_path = _quantized_model_path(model_name)
+    file_name = f"onnx/model_qint8_{LOCAL_EMBEDDING_QUANT_ARCH}.onnx"
+    try:
+        if not os.path.exists(os.path.join(local_path, file_name)):
+            from sentence_transformers import export_dynamic_quantized_onnx_model
+            started = time.perf_counter()
+            model = SentenceTransformer(model_name, device="cpu", backend="onnx")
+            model.save(local_path)
+            export_dynamic_quantized_onnx_model(model, LOCAL_EMBEDDING_QUANT_ARCH, local_path)
+            print(f"已导出 int8 量化 ONNX 模型 {model_name}，耗时 {time.perf_counter() - started:.2f}s")
+        model = SentenceTransformer(local_path, device="cpu", backend="onnx", model_kwargs={"file_name": file_name})
+        return model, f"{model_name}:onnx-int8"
+    except Exception as e:
+        print(f"int8 量化模型不可用，使用未量化 ONNX 模型: {e}")
+        return SentenceTransformer(model_name, device="cpu", backend="onnx"), f"{model_name}:onnx"
+
+
+class LocalEmbeddings(Embeddings):
+    """CPU sentence-transformers embeddings with length-bucketed dynamic batching."""
+
+    def __init__(self, model_name=None, backend=None, quantize=None, query_prefix=None):
+        self.model, self.variant = load_sentence_transformer(model_name, backend, quantize)
+        self.query_prefix = LOCAL_EMBEDDING_QUERY_PREFIX if query_prefix is None else query_prefix
+        # 单个模型实例串行推理，CPU 并行由推理后端内部的线程完成
+        self._lock = threading.Lock()
+
+    @property
+    def dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def _encode(self, texts):
+        texts = list(texts)
+        vectors = [None] * len(texts)
+        with self._lock:
+            for batch in dynamic_batches(texts):
+                encoded = self.model.encode(
+                    [texts[i] for i in batch],
+                    batch_size=len(batch),
+                    normalize_embeddings=True,
+                    convert_to_numpy=True,
+                )
+                for i, vector in zip(batch, encoded):
+                    vectors[i] = vector.tolist()
+        return vectors
+
+    def embed_documents(self, texts):
+        return self._encode(texts)
+
+    def embed_query(self, text):
+        return self._encode([self.query_prefix + text])[0]
+
+    def embed_queries(self, texts):
+        return self._encode([self.query_prefix + t for t in texts])
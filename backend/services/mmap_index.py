@@ -0,0 +1,202 @@
+import os
+import json
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+from db.db import get_conn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 为小会话维护本地 float32 矩阵分片（.npy，内存映射），检索时不访问数据库
+VECTOR_MMAP_INDEX = os.getenv("VECTOR_MMAP_INDEX", "0") == "1"
+MMAP_INDEX_DIR = os.getenv("MMAP_INDEX_DIR") or os.path.join(os.getenv("UPLOAD_DIR", "/tmp"), "vector_shards")
+# 分块数超过该值的会话仍走 pgvector
+MMAP_INDEX_MAX_CHUNKS = int(os.getenv("MMAP_INDEX_MAX_CHUNKS", "20000"))
+MMAP_INDEX_CACHE_SIZE = int(os.getenv("MMAP_INDEX_CACHE_SIZE", "32"))
+SHARD_VERSION = 1
+
+_lock = threading.Lock()
+_loaded = OrderedDict()
+_stats = {"searches": 0, "loads": 0, "builds": 0, "too_large": 0}
+
+
+def _session_prefix(session_id):
+    return os.path.join(MMAP_INDEX_DIR, hashlib.sha1(str(session_id).encode("utf-8")).hexdigest())
+
+
+def _write_json_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def build_session_index(session_id):
+    """Export a session's chunks and L2-normalised embeddings to a new .npy shard; None when the session is too large."""
+    import numpy as np
+
+    prefix = _session_prefix(session_id)
+    meta_path = f"{prefix}.json"
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT count(*) FROM langchain_pg_embedding e
+                JOIN langchain_pg_collection c ON c.uuid = e.collection_id
+                WHERE c.name = %s
+                """,
+                (f"session_{session_id}",),
+            )
+            count = cur.fetchone()[0]
+            rows = []
+            if count <= MMAP_INDEX_MAX_CHUNKS:
+                cur.execute(
+                    """
+                    SELECT e.id, e.document, e.cmetadata, e.embedding::real[]
+                    FROM langchain_pg_embedding e
+                    JOIN langchain_pg_collection c ON c.uuid = e.collection_id
+                    WHERE c.name = %s
+                    ORDER BY e.id
+                    """,
+                    (f"session_{session_id}",),
+                )
+                rows = cur.fetchall()
+    conn.close()
+
+    previous = _read_meta(meta_path)
+    if count > MMAP_INDEX_MAX_CHUNKS:
+        with _lock:
+            _stats["too_large"] += 1
+        meta = {"version": SHARD_VERSION, "too_large": True, "count": count}
+        os.makedirs(MMAP_INDEX_DIR, exist_ok=True)
+        _write_json_atomic(meta_path, meta)
+        _remove_shard(previous)
+        return None
+
+    os.makedirs(MMAP_INDEX_DIR, exist_ok=True)
+    shard = None
+    dim = 0
+    if rows:
+        matrix = np.asarray([r[3] for r in rows], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+        dim = int(matrix.shape[1])
+        # 每次重建写入新文件名，已映射旧分片的进程不受影响
+        shard = f"{os.path.basename(prefix)}.{uuid.uuid4().hex[:12]}.npy"
+        shard_path = os.path.join(MMAP_INDEX_DIR, shard)
+        tmp_path = f"{shard_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, matrix)
+        os.replace(tmp_path, shard_path)
+    meta = {
+        "version": SHARD_VERSION,
+        "too_large": False,
+        "count": len(rows),
+        "dim": dim,
+        "shard": shard,
+        "ids": [r[0] for r in rows],
+        "documents": [r[1] or "" for r in rows],
+        "metadatas": [(json.loads(r[2]) if isinstance(r[2], str) else r[2]) or {} for r in rows],
+    }
+    _write_json_atomic(meta_path, meta)
+    _remove_shard(previous)
+    with _lock:
+        _stats["builds"] += 1
+        _loaded.pop(session_id, None)
+    print(f"向量分片已重建 session={session_id}: {len(rows)} 个分块")
+    return meta
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _remove_shard(meta):
+    # Linux 下删除已被映射的文件不影响现有映射
+    if meta and meta.get("shard"):
+        try:
+            os.remove(os.path.join(MMAP_INDEX_DIR, meta["shard"]))
+        except OSError:
+            pass
+
+
+def _load(session_id):
+    """Memory-map the session shard, reloading when another process rebuilt it."""
+    import numpy as np
+
+    meta_path = f"{_session_prefix(session_id)}.json"
+    try:
+        mtime = os.stat(meta_path).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    with _lock:
+        entry = _loaded.get(session_id)
+        if entry is not None and entry[0] == mtime:
+            _loaded.move_to_end(session_id)
+            return entry[1]
+
+    meta = _read_meta(meta_path) if mtime is not None else None
+    if meta is None or meta.get("version") != SHARD_VERSION:
+        # 旧会话首次检索时补建分片
+        meta = build_session_index(session_id)
+        if meta is None:
+            return None
+        mtime = os.stat(meta_path).st_mtime_ns
+    if meta.get("too_large"):
+        index = None
+    elif meta["count"] == 0:
+        index = {"meta": meta, "matrix": None}
+    else:
+        matrix = np.load(os.path.join(MMAP_INDEX_DIR, meta["shard"]), mmap_mode="r")
+        index = {"meta": meta, "matrix": matrix}
+    with _lock:
+        _stats["loads"] += 1
+        _loaded[session_id] = (mtime, index)
+        _loaded.move_to_end(session_id)
+        while len(_loaded) > MMAP_INDEX_CACHE_SIZE:
+            _loaded.popitem(last=False)
+    return index
+
+
+def search_batch(session_id, vectors, k):
+    """Top-k [Document] per query vector by cosine similarity, or None when the session has no usable shard."""
+    import numpy as np
+    from langchain_core.documents import Document
+
+    index = _load(session_id)
+    if index is None:
+        return None
+    meta = index["meta"]
+    if meta["count"] == 0:
+        return [[] for _ in vectors]
+    queries = np.asarray(vectors, dtype=np.float32)
+    if queries.shape[1] != meta["dim"]:
+        print(f"查询向量维度 {queries.shape[1]} 与分片维度 {meta['dim']} 不一致，改用 pgvector")
+        return None
+    norms = np.linalg.norm(queries, axis=1, keepdims=True)
+    queries /= np.where(norms == 0, 1, norms)
+    scores = queries @ index["matrix"].T
+    k = min(k, meta["count"])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    results = []
+    for row, candidates in zip(scores, top):
+        ranked = candidates[np.argsort(-row[candidates])]
+        results.append([
+            Document(id=meta["ids"][i], page_content=meta["documents"][i], metadata=meta["metadatas"][i])
+            for i in ranked.tolist()
+        ])
+    with _lock:
+        _stats["searches"] += len(results)
+    return results
+
+
+def get_mmap_index_stats():
+    with _lock:
+        return {**_stats, "enabled": VECTOR_MMAP_INDEX, "loaded": len(_loaded), "max_chunks": MMAP_INDEX_MAX_CHUNKS}
@@ -0,0 +1,90 @@
+import os
+import re
+import hashlib
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "1") == "1"
+# 字符 n-gram 长度（中文按字切分）
+DEDUP_SHINGLE = int(os.getenv("DEDUP_SHINGLE", "4"))
+# 64 位 simhash 的汉明距离不超过该值视为近似重复
+DEDUP_MAX_HAMMING = int(os.getenv("DEDUP_MAX_HAMMING", "6"))
+# 较短分块的 shingle 有该比例出现在另一分块中时视为被包含（如整页文本与其 Mineru 版本）
+DEDUP_CONTAINMENT = float(os.getenv("DEDUP_CONTAINMENT", "0.8"))
+
+_NON_WORD = re.compile(r"[\W_]+")
+_lock = threading.Lock()
+_stats = {"calls": 0, "inputs": 0, "suppressed": 0, "llm_calls_saved": 0}
+
+
+def shingles(text, n=None):
+    """Set of 64-bit hashes of character n-grams over the text with whitespace and punctuation removed."""
+    n = n or DEDUP_SHINGLE
+    text = _NON_WORD.sub("", (text or "").lower())
+    if len(text) <= n:
+        grams = {text} if text else set()
+    else:
+        grams = {text[i:i + n] for i in range(len(text) - n + 1)}
+    return {int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest(), "big") for g in grams}
+
+
+def simhash_bits(shingle_sets):
+    """64-bit simhash per shingle set as an (n, 64) boolean matrix."""
+    import numpy as np
+
+    shifts = np.arange(64, dtype=np.uint64)
+    rows = []
+    for hashes in shingle_sets:
+        if not hashes:
+            rows.append(np.zeros(64, dtype=bool))
+            continue
+        h = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+        bits = ((h[:, None] >> shifts) & np.uint64(1)).astype(np.int32)
+        rows.append((2 * bits - 1).sum(axis=0) > 0)
+    return np.vstack(rows)
+
+
+def suppress_near_duplicates(docs, count_llm_calls=False):
+    """Drop retrieved chunks that nearly duplicate a higher-ranked one; keeps the original order.
+
+    count_llm_calls: each input chunk would cost one LLM call, so suppressed
+    chunks are also counted as saved calls.
+    """
+    if not DEDUP_ENABLED or len(docs) < 2:
+        return list(docs)
+    sets = [shingles(d.page_content) for d in docs]
+    bits = simhash_bits(sets)
+    hamming = (bits[:, None, :] != bits[None, :, :]).sum(axis=2)
+    kept = []
+    for i, doc in enumerate(docs):
+        duplicate = False
+        for slot, j in enumerate(kept):
+            if hamming[i, j] <= DEDUP_MAX_HAMMING:
+                duplicate = True
+            else:
+                smaller = min(len(sets[i]), len(sets[j]))
+                duplicate = bool(smaller) and len(sets[i] & sets[j]) / smaller >= DEDUP_CONTAINMENT
+                if duplicate and len(sets[i]) > len(sets[j]):
+                    # 较长的分块包含了较短的一个并多出内容（如多一个数值），保留较长的，放在原排名位置
+                    kept[slot] = i
+            if duplicate:
+                break
+        if not duplicate:
+            kept.append(i)
+    suppressed = len(docs) - len(kept)
+    with _lock:
+        _stats["calls"] += 1
+        _stats["inputs"] += len(docs)
+        _stats["suppressed"] += suppressed
+        if count_llm_calls:
+            _stats["llm_calls_saved"] += suppressed
+    if suppressed:
+        print(f"近似重复分块已合并: {len(docs)} -> {len(kept)}")
+    return [docs[i] for i in kept]
+
+
+def get_dedup_stats():
+    with _lock:
+        return {**_stats, "enabled": DEDUP_ENABLED}
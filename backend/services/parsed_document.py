@@ -0,0 +1,223 @@
+import os
+import json
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ARTIFACT_VERSION = 3
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR") or os.path.join(os.getenv("UPLOAD_DIR", "/tmp"), "artifacts")
+PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", "0")) or (os.cpu_count() or 1)
+# 页数少于该值时直接串行解析，避免进程池启动开销
+PDF_PARSE_MIN_PAGES = int(os.getenv("PDF_PARSE_MIN_PAGES", "16"))
+
+
+def artifact_dir_for(content_hash):
+    return os.path.join(ARTIFACT_DIR, content_hash)
+
+
+def _write_json_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _extract_pages(pdf, start, end):
+    """Yield text, tables and geometry for pages [start, end) of an open pdfplumber document."""
+    for i in range(start, end):
+        page_start = time.perf_counter()
+        page = pdf.pages[i]
+        page_text = page.extract_text() or ""
+        try:
+            tables = [t for t in page.extract_tables() if t]
+        except Exception:
+            tables = []
+        yield {
+            "page": i,
+            "text": page_text,
+            "tables": tables,
+            "width": float(page.width),
+            "height": float(page.height),
+            # 表格线特征，供表格候选页筛选
+            "line_count": len(page.lines),
+            "rect_count": len(page.rects),
+            "elapsed": time.perf_counter() - page_start,
+        }
+        # 释放已解析页面的对象缓存，长文档逐页处理时内存不随页数增长
+        page.flush_cache()
+
+
+def _extract_page_range(file, start, end):
+    """Extract pages [start, end). Runs inside a worker process."""
+    import pdfplumber
+    with pdfplumber.open(file) as pdf:
+        return list(_extract_pages(pdf, start, end))
+
+
+def _iter_parsed_pages(file, workers):
+    """Yield parsed pages in order, fanning page ranges out to a process pool for long PDFs.
+
+    At most two shards per worker are in flight, so a slow consumer bounds the
+    number of parsed pages held in memory.
+    """
+    import pdfplumber
+    with pdfplumber.open(file) as pdf:
+        n_pages = len(pdf.pages)
+        if workers <= 1 or n_pages < PDF_PARSE_MIN_PAGES:
+            # 串行解析：同一个文档句柄逐页产出
+            yield from _extract_pages(pdf, 0, n_pages)
+            return
+
+    import multiprocessing
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+    # 每个 worker 分配多个分片，平衡页面解析耗时不均
+    shard_size = max(1, -(-n_pages // (workers * 4)))
+    ranges = deque((s, min(s + shard_size, n_pages)) for s in range(0, n_pages, shard_size))
+    workers = min(workers, len(ranges))
+    # 调用方已有 embedding/入库等线程在运行，fork 可能复制到被持有的锁而死锁，改用 spawn 启动子进程
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        in_flight = deque()
+        while ranges or in_flight:
+            while ranges and len(in_flight) < workers * 2:
+                start, end = ranges.popleft()
+                in_flight.append(executor.submit(_extract_page_range, file, start, end))
+            yield from in_flight.popleft().result()
+
+
+def iter_document_pages(file_path, content_hash=None, workers=None):
+    """Yield the artifact pages of a PDF in order, parsing and persisting them on first use.
+
+    Pages are appended to pages.jsonl as they are parsed; the manifest is only
+    written once every page is on disk, so an interrupted parse is redone.
+    """
+    if content_hash is None:
+        from services.file_service import file_sha256
+        content_hash = file_sha256(file_path)
+    artifact_dir = artifact_dir_for(content_hash)
+    manifest_path = os.path.join(artifact_dir, "document.json")
+    pages_path = os.path.join(artifact_dir, "pages.jsonl")
+    manifest = _read_json(manifest_path)
+    if manifest and manifest.get("version") == ARTIFACT_VERSION and os.path.exists(pages_path):
+        with open(pages_path, "r", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+        return
+
+    os.makedirs(artifact_dir, exist_ok=True)
+    tmp_path = f"{pages_path}.{os.getpid()}.tmp"
+    started = time.perf_counter()
+    page_count = 0
+    total_elapsed = 0.0
+    slowest = None
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for page in _iter_parsed_pages(file_path, workers or PDF_PARSE_WORKERS):
+                f.write(json.dumps(page, ensure_ascii=False) + "\n")
+                page_count += 1
+                total_elapsed += page["elapsed"]
+                if slowest is None or page["elapsed"] > slowest["elapsed"]:
+                    slowest = {"page": page["page"], "elapsed": page["elapsed"]}
+                yield page
+        os.replace(tmp_path, pages_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    _write_json_atomic(manifest_path, {
+        "version": ARTIFACT_VERSION,
+        "content_hash": content_hash,
+        "source_file": os.path.basename(file_path),
+        "page_count": page_count,
+    })
+    if slowest:
+        print(
+            f"PDF解析完成 {os.path.basename(file_path)}: {page_count} 页, "
+            f"总耗时 {time.perf_counter() - started:.2f}s, 单页累计 {total_elapsed:.2f}s, "
+            f"最慢第 {slowest['page'] + 1} 页 {slowest['elapsed']:.2f}s"
+        )
+
+
+def artifact_handle(file_path, content_hash=None):
+    """Lightweight artifact reference for lazy stages (page renders, camelot, Mineru) without loading pages."""
+    if content_hash is None:
+        from services.file_service import file_sha256
+        content_hash = file_sha256(file_path)
+    return {"content_hash": content_hash, "source_path": os.path.abspath(file_path), "source_file": os.path.basename(file_path)}
+
+
+def load_parsed_document(file_path, content_hash=None, workers=None):
+    """Return the parsed-document artifact for a PDF with all pages loaded.
+
+    The artifact holds per-page text, pdfplumber tables and page geometry; rendered
+    page images and camelot/Mineru output are added lazily by the helpers below.
+    """
+    artifact = artifact_handle(file_path, content_hash)
+    artifact["pages"] = list(iter_document_pages(file_path, artifact["content_hash"], workers))
+    artifact["page_count"] = len(artifact["pages"])
+    return artifact
+
+
+def _cached_stage(artifact, name, builder):
+    """Persist the JSON output of an expensive stage next to the artifact manifest."""
+    path = os.path.join(artifact_dir_for(artifact["content_hash"]), f"{name}.json")
+    cached = _read_json(path)
+    if cached is not None:
+        return cached
+    data = builder()
+    _write_json_atomic(path, data)
+    return data
+
+
+def get_mineru_documents(artifact):
+    """MineruPDFLoader output as [{page_content, metadata}], empty when Mineru is unavailable."""
+    def build():
+        try:
+            from langchain_community.document_loaders import MineruPDFLoader
+            docs = MineruPDFLoader(artifact["source_path"]).load()
+        except Exception:
+            return []
+        return [{"page_content": d.page_content, "metadata": dict(d.metadata)} for d in docs]
+    return _cached_stage(artifact, "mineru", build)
+
+
+def get_camelot_tables(artifact, pages=None):
+    """camelot stream-mode tables as [{page, table_index, text}].
+
+    pages: optional 0-based page indices to restrict camelot to; an empty list skips camelot.
+    """
+    if pages is not None and not pages:
+        return []
+    page_spec = 'all' if pages is None else ",".join(str(p + 1) for p in sorted(pages))
+
+    def build():
+        import camelot
+        tables = camelot.io.read_pdf(artifact["source_path"], pages=page_spec, flavor='stream')
+        results = []
+        for i, table in enumerate(tables):
+            df = table.df
+            if df is not None and not df.empty:
+                try:
+                    page = int(table.page) - 1
+                except (TypeError, ValueError):
+                    page = None
+                results.append({"page": page, "table_index": i, "text": df.to_string(index=False)})
+        return results
+    import hashlib
+    stage_name = "camelot" if page_spec == 'all' else f"camelot_{hashlib.sha1(page_spec.encode()).hexdigest()[:12]}"
+    return _cached_stage(artifact, stage_name, build)
+
+
+def get_page_png(artifact, page_index, dpi=None):
+    """Full-page PNG for VL extraction, served from the shared on-disk render cache."""
+    from services.render_cache import render_page_png
+    return render_page_png(artifact["source_path"], artifact["content_hash"], page_index, dpi=dpi)
@@ -0,0 +1,82 @@
+import os
+import io
+import json
+import time
+import uuid
+import struct
+from db.db import get_conn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# copy: 二进制 COPY 批量写入；orm: PGVector.add_documents 逐行写入
+VECTOR_INSERT_MODE = os.getenv("VECTOR_INSERT_MODE", "copy")
+
+_COPY_SQL = (
+    "COPY langchain_pg_embedding (id, collection_id, embedding, document, cmetadata) "
+    "FROM STDIN WITH (FORMAT binary)"
+)
+_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+_TRAILER = struct.pack(">h", -1)
+
+
+def _field(buf, payload):
+    buf.write(struct.pack(">i", len(payload)))
+    buf.write(payload)
+
+
+def build_copy_buffer(collection_id, ids, texts, metadatas, vectors):
+    """Encode rows in PostgreSQL binary COPY format for langchain_pg_embedding."""
+    collection_bytes = uuid.UUID(str(collection_id)).bytes
+    buf = io.BytesIO()
+    buf.write(_HEADER)
+    for doc_id, text, metadata, vector in zip(ids, texts, metadatas, vectors):
+        buf.write(struct.pack(">h", 5))
+        _field(buf, doc_id.encode("utf-8"))
+        _field(buf, collection_bytes)
+        # pgvector 二进制格式：int16 维度 + int16 保留位 + float4 数组
+        _field(buf, struct.pack(f">HH{len(vector)}f", len(vector), 0, *vector))
+        # PostgreSQL 文本不允许 NUL 字符
+        _field(buf, text.replace("\x00", "").encode("utf-8"))
+        # jsonb 二进制格式：版本号 1 + JSON 文本
+        _field(buf, b"\x01" + json.dumps(metadata, ensure_ascii=False).replace("\\u0000", "").encode("utf-8"))
+    buf.write(_TRAILER)
+    buf.seek(0)
+    return buf
+
+
+def bulk_insert_embeddings(collection_name, texts, metadatas, vectors, ids=None):
+    """Insert precomputed embeddings with one binary COPY in a single transaction. Returns the ids."""
+    ids = ids or [str(uuid.uuid4()) for _ in texts]
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT uuid FROM langchain_pg_collection WHERE name=%s", (collection_name,))
+            row = cur.fetchone()
+            if not row:
+                raise ValueError(f"collection 不存在: {collection_name}")
+            cur.copy_expert(_COPY_SQL, build_copy_buffer(row[0], ids, texts, metadatas, vectors))
+    conn.close()
+    return ids
+
+
+def bulk_insert_documents(collection_name, documents, embeddings):
+    """Embed documents and insert them with binary COPY."""
+    texts = [d.page_content for d in documents]
+    metadatas = [dict(d.metadata) for d in documents]
+    vectors = embeddings.embed_documents(texts)
+    ids = [getattr(d, "id", None) or str(uuid.uuid4()) for d in documents]
+    return bulk_insert_embeddings(collection_name, texts, metadatas, vectors, ids=ids)
+
+
+def insert_documents(vectorstore, documents):
+    """Insert a window of chunks using the configured mode, falling back to add_documents."""
+    if VECTOR_INSERT_MODE == "copy":
+        started = time.perf_counter()
+        try:
+            ids = bulk_insert_documents(vectorstore.collection_name, documents, vectorstore.embeddings)
+            print(f"COPY 写入 {len(ids)} 个分块, 耗时 {time.perf_counter() - started:.2f}s")
+            return ids
+        except Exception as e:
+            print(f"COPY 写入失败，回退 add_documents: {e}")
+    return vectorstore.add_documents(documents)
@@ -1,9 +1,10 @@
 import os
 import json
 import time
+import threading
+from collections import OrderedDict
 from pyexpat import model
 from dotenv import load_dotenv
-from pydantic import SecretStr
 from db.db import get_conn
 
 load_dotenv()
@@ -36,21 +37,114 @@ def get_llm():
     return ChatTongyi(model="qwen-flash", api_key=SecretStr(api_key))
 
 
+# dashscope: 远程 DashScope embedding；local: 本地 CPU sentence-transformers（见 services.local_embeddings）
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "dashscope").lower()
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-v1")
+PGVECTOR_CONN = os.getenv("PGVECTOR_CONN", "postgresql://admin:admin@db:5432/esg_memory")
+# 进程内 vectorstore 句柄缓存：按 collection 的 LRU，空闲超时后淘汰
+VECTORSTORE_CACHE_SIZE = int(os.getenv("VECTORSTORE_CACHE_SIZE", "64"))
+VECTORSTORE_IDLE_SECONDS = int(os.getenv("VECTORSTORE_IDLE_SECONDS", "900"))
+PG_POOL_SIZE = int(os.getenv("PG_POOL_SIZE", "5"))
+PG_MAX_OVERFLOW = int(os.getenv("PG_MAX_OVERFLOW", "10"))
+
+_shared_lock = threading.Lock()
+_embeddings = None
+_engine = None
+_vectorstore_cache = OrderedDict()
+_vectorstore_stats = {"hits": 0, "misses": 0, "evicted": 0}
+
+
+def get_embeddings():
+    """Return the shared embeddings client: cache lookup first, then the configured provider.
+
+    EMBEDDING_PROVIDER=dashscope uses batched concurrent remote calls; local runs
+    a sentence-transformers model on CPU (ONNX, optionally int8-quantised).
+    """
+    global _embeddings
+    with _shared_lock:
+        if _embeddings is None:
+            from services.embedding_cache import CachedEmbeddings
+
+            if EMBEDDING_PROVIDER == "local":
+                from services.local_embeddings import LocalEmbeddings
+                from services.vector_index import EMBEDDING_DIM
+                embeddings = LocalEmbeddings()
+                if embeddings.dimension != EMBEDDING_DIM:
+                    print(f"本地 embedding 维度为 {embeddings.dimension}，请将 EMBEDDING_DIM 设为相同值（当前 {EMBEDDING_DIM}）")
+                _embeddings = CachedEmbeddings(embeddings, model_name=f"local:{embeddings.variant}")
+            else:
+                from langchain_community.embeddings import DashScopeEmbeddings
+                from services.embedding_batcher import BatchedEmbeddings
+
+                api_key = os.environ.get("DASHSCOPE_API_KEY")
+                embeddings = DashScopeEmbeddings(model=EMBEDDING_MODEL, dashscope_api_key=api_key)
+                _embeddings = CachedEmbeddings(BatchedEmbeddings(embeddings), model_name=EMBEDDING_MODEL)
+        return _embeddings
+
+
+def get_pg_engine():
+    """Process-wide SQLAlchemy engine shared by every cached vectorstore."""
+    global _engine
+    with _shared_lock:
+        if _engine is None:
+            from sqlalchemy import create_engine
+            _engine = create_engine(
+                PGVECTOR_CONN,
+                pool_size=PG_POOL_SIZE,
+                max_overflow=PG_MAX_OVERFLOW,
+                pool_pre_ping=True,
+                pool_recycle=1800,
+            )
+            # 每个新连接设置 ef_search / probes
+            from services.vector_index import install_engine_listener
+            install_engine_listener(_engine)
+        return _engine
+
+
 def get_vectorstore(session_id):
+    """Return the cached PGVector handle for a session, creating it on first use."""
     from langchain_postgres.vectorstores import PGVector
-    from langchain_community.embeddings import DashScopeEmbeddings
 
-    api_key = os.environ.get("DASHSCOPE_API_KEY")
-    embeddings = DashScopeEmbeddings(model="text-embedding-v1", dashscope_api_key=api_key)
+    collection_name = f"session_{session_id}"
+    now = time.monotonic()
+    with _shared_lock:
+        # 淘汰空闲过久的句柄（OrderedDict 头部是最久未使用的）
+        while _vectorstore_cache:
+            oldest_name, (_, last_used) = next(iter(_vectorstore_cache.items()))
+            if now - last_used <= VECTORSTORE_IDLE_SECONDS:
+                break
+            _vectorstore_cache.popitem(last=False)
+            _vectorstore_stats["evicted"] += 1
+        entry = _vectorstore_cache.get(collection_name)
+        if entry is not None:
+            _vectorstore_cache[collection_name] = (entry[0], now)
+            _vectorstore_cache.move_to_end(collection_name)
+            _vectorstore_stats["hits"] += 1
+            return entry[0]
+        _vectorstore_stats["misses"] += 1
+
+    from services.vector_index import EMBEDDING_DIM
     vectorstore = PGVector(
-        embeddings,
-        connection=os.getenv("PGVECTOR_CONN", "postgresql://admin:admin@db:5432/esg_memory"),
-        collection_name=f"session_{session_id}",
+        get_embeddings(),
+        connection=get_pg_engine(),
+        collection_name=collection_name,
+        embedding_length=EMBEDDING_DIM,
         use_jsonb=True,
     )
+    with _shared_lock:
+        _vectorstore_cache[collection_name] = (vectorstore, now)
+        _vectorstore_cache.move_to_end(collection_name)
+        while len(_vectorstore_cache) > VECTORSTORE_CACHE_SIZE:
+            _vectorstore_cache.popitem(last=False)
+            _vectorstore_stats["evicted"] += 1
     return vectorstore
 
 
+def get_vectorstore_cache_stats():
+    with _shared_lock:
+        return {**_vectorstore_stats, "cached": len(_vectorstore_cache), "max_size": VECTORSTORE_CACHE_SIZE}
+
+
 def format_source(metadata):
     source_file = metadata.get("source_file") or os.path.basename(metadata.get("source", ""))
     page = metadata.get("page")
@@ -71,87 +165,523 @@ def get_vl_llm(model: str = "qwen3-vl-flash"):
     return ChatTongyi(model=model, api_key=SecretStr(api_key))
 
 
-def ingest_files(session_id, files, chunk_size=500, chunk_overlap=50):
-    """Ingest given files into session vectorstore."""
-    from langchain_text_splitters import RecursiveCharacterTextSplitter
+# 流式入库：每个窗口的分块数，以及解析与向量化之间最多缓冲的窗口数
+INGEST_WINDOW_CHUNKS = int(os.getenv("INGEST_WINDOW_CHUNKS", "64"))
+INGEST_QUEUE_WINDOWS = int(os.getenv("INGEST_QUEUE_WINDOWS", "2"))
+
+
+def iter_file_documents(file, content_hash=None):
+    """Yield Documents for a file lazily, page by page for PDFs."""
+    from langchain_core.documents import Document
     from langchain_community.document_loaders import TextLoader, PDFPlumberLoader, Docx2txtLoader
 
+    if file.endswith('.pdf'):
+        from services.parsed_document import iter_document_pages, artifact_handle, get_mineru_documents
+        yielded = False
+        try:
+            # try mineru first
+            for d in get_mineru_documents(artifact_handle(file, content_hash)):
+                yield Document(page_content=d["page_content"], metadata=d["metadata"])
+            # pages（解析结果逐页落盘为 artifact，后续表格/VL 阶段直接复用）
+            for page in iter_document_pages(file, content_hash=content_hash):
+                yielded = True
+                yield Document(page_content=page["text"], metadata={"source_file": os.path.basename(file), "page": page["page"], "type": "text"})
+        except Exception:
+            if yielded:
+                raise
+            loader = PDFPlumberLoader(file)
+            for doc in loader.lazy_load():
+                doc.metadata["source_file"] = os.path.basename(file)
+                doc.metadata["type"] = "text"
+                yield doc
+    elif file.endswith('.docx'):
+        yield from Docx2txtLoader(file).lazy_load()
+    else:
+        yield from TextLoader(file).lazy_load()
+
+
+def _produce_chunk_windows(file, content_hash, splitter, out_queue, stop_event, window_size):
+    """Parse and split a file, putting windows of chunks on out_queue (blocks when the queue is full)."""
+    import queue
+
+    def put(item):
+        while not stop_event.is_set():
+            try:
+                out_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        window = []
+        source_path = os.path.abspath(file) if os.path.isfile(file) else None
+        for doc in iter_file_documents(file, content_hash):
+            doc.metadata["source_file"] = os.path.basename(file)
+            doc.metadata["content_hash"] = content_hash
+            # 仅当文件真实存在时才保存 source_path
+            if source_path:
+                doc.metadata["source_path"] = source_path
+            else:
+                # 若文件不存在，避免写入无效路径
+                doc.metadata.pop("source_path", None)
+            window.extend(splitter.split_documents([doc]))
+            while len(window) >= window_size:
+                if not put(window[:window_size]):
+                    return
+                window = window[window_size:]
+        if window:
+            put(window)
+    except BaseException as e:
+        put(e)
+    finally:
+        put(None)
+
+
+def _ingest_file_streaming(vectorstore, file, content_hash, splitter, progress=None):
+    """Run parse -> split -> embed -> insert for one file in bounded windows.
+
+    Parsing and splitting run in a producer thread while the caller embeds and
+    inserts; every committed window is immediately searchable. Returns the
+    number of chunks inserted.
+    """
+    import queue
+    import threading
+    from services.pgvector_bulk import insert_documents
+    from services.kpi_candidates import KPI_INDEX_ENABLED, extract_from_documents, extract_from_artifact_tables, store_kpi_candidates
+
+    window_queue = queue.Queue(maxsize=INGEST_QUEUE_WINDOWS)
+    stop_event = threading.Event()
+    producer = threading.Thread(
+        target=_produce_chunk_windows,
+        args=(file, content_hash, splitter, window_queue, stop_event, INGEST_WINDOW_CHUNKS),
+        daemon=True,
+    )
+    producer.start()
+    inserted = 0
+    kpi_candidates = []
+    started = time.perf_counter()
+    try:
+        while True:
+            window = window_queue.get()
+            if window is None:
+                break
+            if isinstance(window, BaseException):
+                raise window
+            insert_documents(vectorstore, window)
+            inserted += len(window)
+            if KPI_INDEX_ENABLED:
+                kpi_candidates.extend(extract_from_documents(window))
+            if progress:
+                progress("ingest", file=os.path.basename(file), chunks=inserted)
+    finally:
+        stop_event.set()
+        producer.join(timeout=5)
+    if inserted:
+        print(
+            f"向量入库完成 {os.path.basename(file)}: {inserted} 个分块, "
+            f"{inserted / max(time.perf_counter() - started, 1e-6):.1f} chunks/s"
+        )
+    if KPI_INDEX_ENABLED and content_hash:
+        # KPI 候选按文件内容哈希保存，复用分块的会话可直接查到
+        try:
+            if file.endswith('.pdf'):
+                kpi_candidates.extend(extract_from_artifact_tables(file, content_hash))
+            stored = store_kpi_candidates(content_hash, kpi_candidates)
+            print(f"KPI 候选索引 {os.path.basename(file)}: {stored} 条")
+        except Exception as e:
+            print(f"KPI 候选索引失败 {file}: {e}")
+    return inserted
+
+
+def ingest_files(session_id, files, chunk_size=500, chunk_overlap=50, progress=None, content_hashes=None):
+    """Ingest given files into session vectorstore.
+
+    content_hashes: optional {file path: sha256} computed while the upload was
+    written to disk; files missing from it are hashed here.
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    from services.file_service import file_sha256
+    from services.document_registry import ensure_registry_table, session_has_document, find_reusable_session, link_document_chunks, record_document, delete_document_chunks
+
     vectorstore = get_vectorstore(session_id)
     splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    ensure_registry_table()
+    # 跨会话复用分块时要求向量来自同一模型与维度
+    from services.vector_index import EMBEDDING_DIM
+    embedding_model = get_embeddings().model_name
+    from services.kpi_candidates import KPI_INDEX_ENABLED, ensure_kpi_table
+    if KPI_INDEX_ENABLED:
+        ensure_kpi_table()
 
     for file in files:
-        docs = []
+        content_hash = None
         try:
-            if file.endswith('.pdf'):
-                # try mineru first
+            # 按文件内容哈希去重：已入库的相同文件直接复用分块与向量
+            content_hash = (content_hashes or {}).get(file) or file_sha256(file)
+            if session_has_document(session_id, content_hash):
+                print(f"跳过重复文件 {os.path.basename(file)}: 本会话已入库")
+                continue
+            source_session = find_reusable_session(content_hash, session_id, embedding_model, EMBEDDING_DIM)
+            if source_session:
+                linked = link_document_chunks(content_hash, source_session, session_id, os.path.basename(file), os.path.abspath(file), EMBEDDING_DIM)
+                if linked:
+                    record_document(content_hash, session_id, os.path.basename(file), file, linked, embedding_model, EMBEDDING_DIM)
+                    print(f"复用已解析文件 {os.path.basename(file)}: 来自 session {source_session}, {linked} 个分块")
+                    continue
+
+            inserted = _ingest_file_streaming(vectorstore, file, content_hash, splitter, progress=progress)
+            if inserted:
+                record_document(content_hash, session_id, os.path.basename(file), file, inserted, embedding_model, EMBEDDING_DIM)
+        except Exception as e:
+            print(f"Ingest 文件失败 {file}: {e}")
+            # 清理未完成文件已写入的分块，避免下次重传时重复
+            if content_hash:
                 try:
-                    from langchain_community.document_loaders import MineruPDFLoader
-                    loader = MineruPDFLoader(file)
-                    docs = loader.load()
-                except Exception:
-                    pass
+                    delete_document_chunks(session_id, content_hash)
+                except Exception as cleanup_error:
+                    print(f"清理未完成分块失败 {file}: {cleanup_error}")
 
-                # pages
-                try:
-                    import pdfplumber
-                    from langchain_core.documents import Document
-                    with pdfplumber.open(file) as pdf:
-                        for i, page in enumerate(pdf.pages):
-                            page_text = page.extract_text() or ""
-                            doc = Document(page_content=page_text, metadata={"source_file": os.path.basename(file), "page": i, "type": "text"})
-                            docs.append(doc)
-                except Exception:
-                    loader = PDFPlumberLoader(file)
-                    text_docs = loader.load()
-                    for doc in text_docs:
-                        doc.metadata["source_file"] = os.path.basename(file)
-                        doc.metadata["type"] = "text"
-                    docs.extend(text_docs)
-            elif file.endswith('.docx'):
-                loader = Docx2txtLoader(file)
-                docs = loader.load()
-            else:
-                loader = TextLoader(file)
-                docs = loader.load()
+    from services.mmap_index import VECTOR_MMAP_INDEX, build_session_index
+    if VECTOR_MMAP_INDEX:
+        try:
+            build_session_index(session_id)
+        except Exception as e:
+            print(f"重建向量分片失败 session={session_id}: {e}")
+
+
+def chunk_fingerprint(doc):
+    """Stable identifier for a retrieved chunk: the vectorstore id, else a content hash."""
+    doc_id = getattr(doc, "id", None)
+    if doc_id:
+        return str(doc_id)
+    import hashlib
+    key = f"{format_source(doc.metadata)}\n{doc.page_content}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+# vector: 仅向量检索；hybrid: BM25 与向量结果按 RRF 融合
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector").lower()
+# hybrid 模式下每路召回的候选数（至少 HYBRID_MIN_CANDIDATES，且不少于 k 的倍数）
+HYBRID_FETCH_FACTOR = int(os.getenv("HYBRID_FETCH_FACTOR", "4"))
+HYBRID_MIN_CANDIDATES = int(os.getenv("HYBRID_MIN_CANDIDATES", "20"))
+RRF_K = int(os.getenv("RRF_K", "60"))
 
-            import os
-            for doc in docs:
-                doc.metadata["source_file"] = os.path.basename(file)
-                # 仅当文件真实存在时才保存 source_path
-                if os.path.isfile(file):
-                    doc.metadata["source_path"] = os.path.abspath(file)
-                else:
-                    # 若文件不存在，避免写入无效路径
-                    doc.metadata.pop("source_path", None)
 
-            chunks = splitter.split_documents(docs)
-            if chunks:
-                vectorstore.add_documents(chunks)
+def search_docs(session_id, query, k=3, mode=None):
+    """Return top-k documents for a session vectorstore.
+
+    mode: "vector" or "hybrid"; defaults to RETRIEVAL_MODE.
+    """
+    from services.mmap_index import VECTOR_MMAP_INDEX
+    from services.reranker import RERANK_ENABLED
+    mode = mode or RETRIEVAL_MODE
+    if mode == "hybrid" or VECTOR_MMAP_INDEX or RERANK_ENABLED:
+        try:
+            return search_docs_batch(session_id, [query], k=k, mode=mode).get(query, [])
         except Exception as e:
-            print(f"Ingest 文件失败 {file}: {e}")
+            print(f"search_docs 异常: {e}")
+            return []
+    return _similarity_search(session_id, query, k)
 
 
-def search_docs(session_id, query, k=3):
-    """Return top-k documents for a session vectorstore."""
-    vectorstore = get_vectorstore(session_id)
+def _similarity_search(session_id, query, k):
+    """Plain PGVector top-k for one query; never routes back through the batch path."""
     try:
-        return vectorstore.similarity_search(query, k=k)
+        return get_vectorstore(session_id).similarity_search(query, k=k)
     except Exception as e:
         print(f"search_docs 异常: {e}")
         return []
 
 
-def run_rag_on_question(session_id, question, qtype, options=None, k=3):
+def _vector_literal(vector):
+    return "[" + ",".join(repr(float(x)) for x in vector) + "]"
+
+
+def _knn_rows(cur, vectors, collection, k, exact=False):
+    """(ord, id, document, cmetadata) rows, nearest first, for every query vector in one LATERAL-join statement.
+
+    exact: order by an expression the ANN index cannot serve, forcing an exact scan of the collection.
+    """
+    distance = "(embedding <=> q.vec::vector) + 0" if exact else "embedding <=> q.vec::vector"
+    cur.execute(
+        f"""
+        SELECT q.ord, e.id, e.document, e.cmetadata
+        FROM unnest(%s::text[]) WITH ORDINALITY AS q(vec, ord)
+        CROSS JOIN LATERAL (
+            SELECT id, document, cmetadata, {distance} AS distance
+            FROM langchain_pg_embedding
+            WHERE collection_id = (SELECT uuid FROM langchain_pg_collection WHERE name = %s)
+            ORDER BY {distance}
+            LIMIT %s
+        ) e
+        ORDER BY q.ord, e.distance
+        """,
+        ([_vector_literal(v) for v in vectors], collection, k),
+    )
+    return cur.fetchall()
+
+
+def _vector_search_batch(session_id, queries, k):
+    """Dense top-k for every query: one embedding pass, then the session's mmap shard or one LATERAL-join SQL statement."""
+    from langchain_core.documents import Document
+
+    try:
+        vectors = get_embeddings().embed_queries(queries)
+        from services.mmap_index import VECTOR_MMAP_INDEX, search_batch
+        if VECTOR_MMAP_INDEX:
+            try:
+                local = search_batch(session_id, vectors, k)
+            except Exception as e:
+                print(f"本地向量分片检索失败，改用 pgvector: {e}")
+                local = None
+            if local is not None:
+                return dict(zip(queries, local))
+        from services.vector_index import apply_search_settings, get_pgvector_version
+        collection = f"session_{session_id}"
+        conn = get_conn()
+        with conn:
+            with conn.cursor() as cur:
+                apply_search_settings(cur)
+                rows = _knn_rows(cur, vectors, collection, k)
+                # pgvector < 0.8 没有 iterative_scan，按 collection 过滤后 ANN 可能返回不足 k 条，改用精确扫描重查
+                counts = {}
+                for row in rows:
+                    counts[row[0]] = counts.get(row[0], 0) + 1
+                short = [i for i in range(1, len(vectors) + 1) if counts.get(i, 0) < k]
+                if short and get_pgvector_version(cur) < (0, 8):
+                    exact = _knn_rows(cur, [vectors[i - 1] for i in short], collection, k, exact=True)
+                    rows = [r for r in rows if r[0] not in short] + [(short[r[0] - 1],) + tuple(r[1:]) for r in exact]
+                    rows.sort(key=lambda r: r[0])
+        conn.close()
+        fetched = {q: [] for q in queries}
+        for ord_, doc_id, document, metadata in rows:
+            if isinstance(metadata, str):
+                metadata = json.loads(metadata)
+            fetched[queries[ord_ - 1]].append(Document(id=doc_id, page_content=document, metadata=metadata or {}))
+        return fetched
+    except Exception as e:
+        print(f"search_docs_batch 异常，逐条检索: {e}")
+        return {q: _similarity_search(session_id, q, k) for q in queries}
+
+
+def reciprocal_rank_fusion(ranked_lists, k=None, rrf_k=None):
+    """Fuse several ranked document lists: score = sum(1 / (rrf_k + rank)) over the lists a chunk appears in."""
+    rrf_k = rrf_k or RRF_K
+    scores = {}
+    docs = {}
+    for ranked in ranked_lists:
+        for rank, doc in enumerate(ranked, start=1):
+            key = getattr(doc, "id", None) or chunk_fingerprint(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    fused = [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
+    return fused[:k] if k else fused
+
+
+def _hybrid_search_batch(session_id, queries, k):
+    """BM25 and dense candidates per query, fused with reciprocal rank fusion."""
+    fetch_k = max(k * HYBRID_FETCH_FACTOR, HYBRID_MIN_CANDIDATES)
+    dense = _vector_search_batch(session_id, queries, fetch_k)
+    try:
+        from services.lexical_index import bm25_search_batch
+        lexical = bm25_search_batch(session_id, queries, k=fetch_k)
+    except Exception as e:
+        print(f"BM25 检索失败，仅使用向量结果: {e}")
+        lexical = {}
+    return {q: reciprocal_rank_fusion([dense.get(q, []), lexical.get(q, [])], k=k) for q in queries}
+
+
+def search_docs_batch(session_id, queries, k=3, cache=None, mode=None, rerank=None):
+    """Return {query: top-k documents} for many queries with one embedding pass and one SQL statement.
+
+    All k-NN lookups run in a single round trip via a LATERAL join over the
+    query vectors; in hybrid mode they are fused with BM25 results.
+    rerank: over-fetch RERANK_FETCH_K candidates and keep the cross-encoder's
+    top chunks above the threshold (may return fewer than k); defaults to RERANK_ENABLED.
+    cache: optional dict shared across a pipeline; results for (query, k, mode, rerank)
+    already in it are reused, and new results are added to it.
+    """
+    from services.reranker import RERANK_ENABLED, RERANK_FETCH_K
+    mode = mode or RETRIEVAL_MODE
+    rerank = RERANK_ENABLED if rerank is None else rerank
+    cache = cache if cache is not None else {}
+    results = {}
+    pending = []
+    for q in dict.fromkeys(queries):
+        hit = next((docs for (cq, ck, cm, cr), docs in cache.items() if cq == q and cm == mode and cr == rerank and ck >= k), None)
+        if hit is not None:
+            results[q] = hit[:k]
+        else:
+            pending.append(q)
+    if not pending:
+        return results
+
+    fetch_k = max(k, RERANK_FETCH_K) if rerank else k
+    if mode == "hybrid":
+        fetched = _hybrid_search_batch(session_id, pending, fetch_k)
+    else:
+        fetched = _vector_search_batch(session_id, pending, fetch_k)
+    if rerank:
+        try:
+            from services.reranker import rerank_batch
+            fetched = rerank_batch(fetched, top_n=k)
+        except Exception as e:
+            print(f"重排失败，使用原始检索顺序: {e}")
+            fetched = {q: docs[:k] for q, docs in fetched.items()}
+    for q, docs in fetched.items():
+        cache[(q, k, mode, rerank)] = docs
+        results[q] = docs
+    return results
+
+
+# 合并模式：一个问题的全部分块带来源标签放入一次 LLM 调用，按来源返回 JSON
+RAG_CONSOLIDATED = os.getenv("RAG_CONSOLIDATED", "1") not in ("0", "false", "False")
+
+_rag_lock = threading.Lock()
+_rag_stats = {"questions": 0, "llm_calls": 0, "consolidated": 0, "fallbacks": 0}
+
+
+def _bump_rag(**counts):
+    with _rag_lock:
+        for k, v in counts.items():
+            _rag_stats[k] += v
+
+
+def get_rag_stats():
+    with _rag_lock:
+        stats = dict(_rag_stats)
+    stats["calls_per_question"] = round(stats["llm_calls"] / stats["questions"], 2) if stats["questions"] else None
+    stats["consolidated_mode"] = RAG_CONSOLIDATED
+    return stats
+
+
+def _parse_rag_value(value, qtype, options=None):
+    """Normalise one answer for a question type; None when it carries no usable value."""
+    import re
+
+    if qtype == "float":
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+        value_clean = str(value).replace(",", "")
+        match = re.search(r"[-+]?[0-9]*\.?[0-9]+", value_clean)
+        return float(match.group()) if match else None
+    if qtype == "text":
+        value = str(value).strip() if value is not None else ""
+        return value or None
+    if qtype == "list":
+        try:
+            parsed = value if isinstance(value, list) else json.loads(value)
+            if isinstance(parsed, list):
+                normalized = [
+                    item.strip().strip("'").strip('"')
+                    for item in parsed
+                    if isinstance(item, str)
+                ]
+            else:
+                normalized = []
+        except Exception:
+            normalized = [v.strip().strip("'").strip('"') for v in str(value).split(',') if v.strip()]
+        if options:
+            normalized = [item for item in normalized if item in options]
+        return normalized or None
+    return None
+
+
+def _parse_json_payload(text):
+    """Parse a JSON array/object from model output, tolerating code fences and surrounding prose."""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        if text.lower().startswith("json"):
+            text = text[4:]
+    try:
+        return json.loads(text)
+    except Exception:
+        pass
+    for open_ch, close_ch in (("[", "]"), ("{", "}")):
+        start, end = text.find(open_ch), text.rfind(close_ch)
+        if start != -1 and end > start:
+            try:
+                return json.loads(text[start:end + 1])
+            except Exception:
+                continue
+    raise ValueError("no JSON payload")
+
+
+def _run_rag_consolidated(llm, question, qtype, options, docs, hints=None):
+    """One LLM call for all chunks: returns (values, sources) in chunk order; raises when the reply is unusable."""
+    tagged = "\n\n".join(f"[S{i}] {doc.page_content}" for i, doc in enumerate(docs, start=1))
+    if qtype == "list" and options:
+        answer_rule = f"answer 为从可选项中选择的JSON数组。可选项：{options}"
+    elif qtype == "float":
+        answer_rule = "answer 为数值（不带单位），无相关数值时为 null"
+    else:
+        answer_rule = "answer 为简短答案文本，无相关信息时为 null"
+    prompt = (
+        "请根据以下带来源标签的内容分别回答问卷问题，每个来源独立作答，不要合并或推断。\n"
+        f"问题：{question}\n"
+        f"输出JSON数组，每个来源一项：[{{\"source\": \"S1\", \"answer\": ...}}]；{answer_rule}。只输出JSON，不要解释。\n"
+        + (f"{hints}\n" if hints else "")
+        + f"内容：\n{tagged}"
+    )
+    payload = _parse_json_payload(_ai_to_text(llm.invoke(prompt)))
+    if isinstance(payload, dict):
+        # 兼容 {"S1": ..., "S2": ...} 形式
+        payload = [{"source": k, "answer": v} for k, v in payload.items()]
+    if not isinstance(payload, list):
+        raise ValueError("unexpected JSON payload")
+
+    answers = {}
+    for item in payload:
+        if not isinstance(item, dict):
+            continue
+        tag = str(item.get("source", "")).strip().strip("[]").upper()
+        if not tag.startswith("S") or not tag[1:].isdigit():
+            continue
+        index = int(tag[1:]) - 1
+        if 0 <= index < len(docs) and item.get("answer") not in (None, "", []):
+            answers[index] = item["answer"]
+    values = []
+    sources = []
+    for index, doc in enumerate(docs):
+        if index not in answers:
+            continue
+        parsed = _parse_rag_value(answers[index], qtype, options)
+        if parsed is not None:
+            values.append(parsed)
+            sources.append(format_source(doc.metadata))
+    return values, sources
+
+
+def run_rag_on_question(session_id, question, qtype, options=None, k=3, docs=None, consolidated=None, hints=None):
     """Run RAG for a single question and return (values, sources).
     values: list of extracted values (floats, strings, or list for list-type)
     sources: corresponding list of source strings
+    docs: already retrieved documents; searched when omitted
+    consolidated: one LLM call with source-tagged chunks instead of one call per chunk;
+    defaults to RAG_CONSOLIDATED and falls back to per-chunk calls if the reply cannot be parsed
+    hints: optional extra prompt text (e.g. unverified KPI index candidates)
     """
-    docs = search_docs(session_id, question, k=k)
+    if docs is None:
+        docs = search_docs(session_id, question, k=k)
+    consolidated = RAG_CONSOLIDATED if consolidated is None else consolidated
+    # 同页 text/table/Mineru 分块内容几乎相同，合并后避免重复调用 LLM 与虚假冲突
+    from services.near_duplicates import suppress_near_duplicates
+    docs = suppress_near_duplicates(docs, count_llm_calls=not consolidated)
     if not docs:
         return [], []
 
     llm = get_llm()
-    import re
+    _bump_rag(questions=1)
+    if consolidated and len(docs) > 1:
+        try:
+            _bump_rag(llm_calls=1, consolidated=1)
+            return _run_rag_consolidated(llm, question, qtype, options, docs, hints=hints)
+        except Exception as e:
+            _bump_rag(fallbacks=1)
+            print(f"合并RAG解析失败，逐分块调用: {e}")
 
     values = []
     sources = []
@@ -166,38 +696,15 @@ def run_rag_on_question(session_id, question, qtype, options=None, k=3):
             )
         else:
             rag_prompt = f"请根据以下内容回答问卷问题，只输出答案，不要解释。\n问题：{question}\n内容：{doc.page_content}"
+        if hints:
+            rag_prompt += f"\n{hints}"
 
         ai_result = llm.invoke(rag_prompt)
-        value = _ai_to_text(ai_result)
-
-        if qtype == "float":
-            value_clean = value.replace(",", "")
-            match = re.search(r"[-+]?[0-9]*\.?[0-9]+", value_clean)
-            if match:
-                values.append(float(match.group()))
-                sources.append(format_source(doc.metadata))
-        elif qtype == "text":
-            if value:
-                values.append(value)
-                sources.append(format_source(doc.metadata))
-        elif qtype == "list":
-            try:
-                parsed = json.loads(value)
-                if isinstance(parsed, list):
-                    normalized = [
-                        item.strip().strip("'").strip('"')
-                        for item in parsed
-                        if isinstance(item, str)
-                    ]
-                else:
-                    normalized = []
-            except Exception:
-                normalized = [v.strip().strip("'").strip('"') for v in value.split(',') if v.strip()]
-            if options:
-                normalized = [item for item in normalized if item in options]
-            if normalized:
-                values.append(normalized)
-                sources.append(format_source(doc.metadata))
+        _bump_rag(llm_calls=1)
+        value = _parse_rag_value(_ai_to_text(ai_result), qtype, options)
+        if value is not None:
+            values.append(value)
+            sources.append(format_source(doc.metadata))
 
     return values, sources
 
@@ -206,6 +713,8 @@ def run_module_level_rag(session_id, key, company_name, docs):
     """Detect modules from docs, then run per-module RAG to extract measures and provide a summary."""
     if not docs:
         return [], {}, ""
+    from services.near_duplicates import suppress_near_duplicates
+    docs = suppress_near_duplicates(docs)
     llm = get_llm()
     try:
         contents = "\n\n".join([d.page_content[:2000] for d in docs])
@@ -287,45 +796,16 @@ def save_answers(session_id, answer_update, answer_sources, answer_conflicts, qu
                 cur.execute("INSERT INTO answers (session_id, questionnaire_id, answers) VALUES (%s, %s, %s)", (session_id, questionnaire_id, json.dumps(answer_update)))
     conn.close()
 
-from langchain_community.chat_models import ChatTongyi
-from langchain_core.messages import HumanMessage
-
 def qwen_vl_langchain_qa(img_bytes, question, timeout_s=30):
-    api_key = os.environ.get("DASHSCOPE_API_KEY") or ""
-    if not api_key:
-
-        print("VL调用跳过：未设置DASHSCOPE_API_KEY")
-
-        return ""
-    chatLLM = ChatTongyi(model="qwen-vl-max", api_key=SecretStr(api_key))
-    image_message = {"image": img_bytes}
-    text_message = {"text": question}
-    message = HumanMessage(content=[text_message, image_message])
-    from concurrent.futures import ThreadPoolExecutor, TimeoutError
-    from contextvars import copy_context
-    executor = ThreadPoolExecutor(max_workers=1)
-    try:
-        print(f"VL调用开始：timeout={timeout_s}s")
-        context = copy_context()
-        future = executor.submit(context.run, chatLLM.invoke, [message])
-        try:
-            result = future.result(timeout=timeout_s)
-        except TimeoutError:
-            print("VL调用超时")
-            future.cancel()
-            return ""
-        except Exception as e:
-            print(f"VL调用失败: {e}")
-            return ""
-    finally:
-        executor.shutdown(wait=False, cancel_futures=True)
-    print("VL调用完成")
-    return result.content
+    """Single VL call through the shared bounded async client (services.vl_client)."""
+    from services.vl_client import vl_qa
+    return vl_qa(img_bytes, question, timeout_s=timeout_s)
 
 
-def run_vl_kpi_extraction(docs, key, timeout_s=30):
-    print(f"VL抽取开始：key={key}, docs={len(docs)}")
+def _vl_pages_by_file(docs):
+    """Group retrieved docs into {pdf_path: set(page_index)} plus known content hashes."""
     pages_by_file = {}
+    hash_by_file = {}
     for d in docs:
         src = d.metadata.get("source_path") or d.metadata.get("source_file")
         if src and not os.path.exists(src):
@@ -343,32 +823,126 @@ def run_vl_kpi_extraction(docs, key, timeout_s=30):
         if src not in pages_by_file:
             pages_by_file[src] = set()
         pages_by_file[src].add(pi)
+        if d.metadata.get("content_hash"):
+            hash_by_file[src] = d.metadata["content_hash"]
+    return pages_by_file, hash_by_file
 
-    vl_responses = {}
+
+def run_vl_kpi_extraction(docs, key, timeout_s=30):
+    print(f"VL抽取开始：key={key}, docs={len(docs)}")
+    pages_by_file, hash_by_file = _vl_pages_by_file(docs)
+
+    prompt = (
+        "根据整页图片内容，回答以下指标的数值（如果图片中无相关信息请直接返回空）：\n"
+        f"指标：{key}\n"
+        "请直接输出纯数字或百分比（例如：12345 或 12.3%），不要解释。"
+    )
+    refs = []
+    requests = []
+    from services.parsed_document import artifact_handle, get_page_png
     for src, page_set in pages_by_file.items():
         try:
-            import pymupdf
-            with pymupdf.open(src) as doc:
-                for pi in sorted(page_set):
-                    try:
-                        page_start = time.time()
-                        page = doc[pi]
-                        pix = page.get_pixmap()
-                        img_bytes = pix.tobytes("png")
-                        print(f"[VL整页截图] {os.path.basename(src)} page {pi+1}: 已生成整页图片, 耗时: {time.time() - page_start:.2f}s")
-                        prompt = (
-                            "根据整页图片内容，回答以下指标的数值（如果图片中无相关信息请直接返回空）：\n"
-                            f"指标：{key}\n"
-                            "请直接输出纯数字或百分比（例如：12345 或 12.3%），不要解释。"
-                        )
-                        text = qwen_vl_langchain_qa(img_bytes, prompt, timeout_s=timeout_s)
-                        if text:
-                            vl_responses[f"{os.path.basename(src)}:page_{pi+1}_fullpage"] = text
-                    except Exception as e:
-                        print(f"整页截图失败: {e}")
-                        continue
+            artifact = artifact_handle(src, content_hash=hash_by_file.get(src))
+            for pi in sorted(page_set):
+                try:
+                    page_start = time.time()
+                    img_bytes = get_page_png(artifact, pi)
+                    print(f"[VL整页截图] {os.path.basename(src)} page {pi+1}: 已生成整页图片, 耗时: {time.time() - page_start:.2f}s")
+                    refs.append(f"{os.path.basename(src)}:page_{pi+1}_fullpage")
+                    requests.append((img_bytes, prompt))
+                except Exception as e:
+                    print(f"整页截图失败: {e}")
+                    continue
         except Exception as e:
             print(f"打开PDF失败: {e}")
             continue
+
+    # 各页请求在共享并发上限内并行执行
+    from services.vl_client import vl_qa_many
+    vl_responses = {}
+    for ref, text in zip(refs, vl_qa_many(requests, timeout_s=timeout_s) if requests else []):
+        if text:
+            vl_responses[ref] = text
     print(f"VL抽取完成：key={key}, responses={len(vl_responses)}")
     return vl_responses
+
+
+KPI_DESCRIPTIONS = {
+    "scope1": "Scope 1 直接温室气体排放（吨 CO2 当量）",
+    "scope2": "Scope 2 能源间接温室气体排放（吨 CO2 当量）",
+    "scope3": "Scope 3 其他间接温室气体排放（吨 CO2 当量）",
+    "energy_total": "总能耗（kWh）",
+    "renewable_ratio": "可再生能源占比（%）",
+    "hazardous_waste": "危险废弃物总量（kg）",
+    "nonhazardous_waste": "非危险废弃物总量（kg）",
+    "recycled_waste": "回收/再利用废弃物总量（kg）",
+}
+
+
+def _parse_vl_json(text):
+    """Parse a JSON object from a VL answer, tolerating code fences and single quotes."""
+    import re
+    if isinstance(text, list):
+        text = " ".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in text)
+    match = re.search(r"\{.*\}", str(text), re.S)
+    if not match:
+        return {}
+    raw = match.group()
+    for candidate in (raw, raw.replace("'", '"')):
+        try:
+            parsed = json.loads(candidate)
+            return parsed if isinstance(parsed, dict) else {}
+        except Exception:
+            continue
+    return {}
+
+
+def run_vl_kpi_extraction_batch(docs_by_key, timeout_s=30):
+    """Multi-KPI VL extraction: one vision call per page for every KPI key that retrieved it.
+
+    docs_by_key: {kpi_key: retrieved docs}. Returns {kpi_key: {ref: value}} in the
+    same shape run_vl_kpi_extraction returns per key.
+    """
+    keys_by_page = {}
+    hash_by_file = {}
+    for key, docs in docs_by_key.items():
+        pages_by_file, hashes = _vl_pages_by_file(docs)
+        hash_by_file.update(hashes)
+        for src, page_set in pages_by_file.items():
+            for pi in page_set:
+                keys_by_page.setdefault((src, pi), set()).add(key)
+    print(f"VL批量抽取开始：keys={len(docs_by_key)}, pages={len(keys_by_page)}, "
+          f"逐key调用需 {sum(len(k) for k in keys_by_page.values())} 次")
+
+    results = {key: {} for key in docs_by_key}
+    page_jobs = []
+    requests = []
+    from services.parsed_document import artifact_handle, get_page_png
+    for (src, pi), keys in sorted(keys_by_page.items()):
+        keys = sorted(keys)
+        try:
+            artifact = artifact_handle(src, content_hash=hash_by_file.get(src))
+            img_bytes = get_page_png(artifact, pi)
+        except Exception as e:
+            print(f"VL批量抽取失败 {os.path.basename(src)} page {pi+1}: {e}")
+            continue
+        kpi_lines = "\n".join(f"- {k}: {KPI_DESCRIPTIONS.get(k, k)}" for k in keys)
+        prompt = (
+            "根据整页图片内容，回答以下各项指标的数值：\n"
+            f"{kpi_lines}\n"
+            "只输出一个JSON对象，键为上面的指标名，值为纯数字或百分比字符串（例如 12345 或 \"12.3%\"），"
+            "图片中没有的指标值填 null，不要解释。"
+        )
+        page_jobs.append((f"{os.path.basename(src)}:page_{pi+1}_fullpage", keys))
+        requests.append((img_bytes, prompt))
+
+    # 各页请求在共享并发上限内并行执行
+    from services.vl_client import vl_qa_many
+    for (ref, keys), text in zip(page_jobs, vl_qa_many(requests, timeout_s=timeout_s) if requests else []):
+        parsed = _parse_vl_json(text) if text else {}
+        for key in keys:
+            value = parsed.get(key)
+            if value not in (None, ""):
+                results[key][ref] = str(value)
+    print(f"VL批量抽取完成：responses={sum(len(v) for v in results.values())}")
+    return results
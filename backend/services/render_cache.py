@@ -0,0 +1,92 @@
+import os
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RENDER_CACHE_DIR = os.getenv("RENDER_CACHE_DIR") or os.path.join(os.getenv("UPLOAD_DIR", "/tmp"), "render_cache")
+RENDER_CACHE_MAX_BYTES = int(os.getenv("RENDER_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+# pymupdf get_pixmap() 的默认分辨率
+RENDER_DPI = int(os.getenv("RENDER_DPI", "72"))
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evicted": 0}
+_total_bytes = None
+
+
+def _cache_path(content_hash, page_index, dpi):
+    return os.path.join(RENDER_CACHE_DIR, f"{content_hash}_p{page_index}_{dpi}dpi.png")
+
+
+def _scan():
+    entries = []
+    try:
+        with os.scandir(RENDER_CACHE_DIR) as it:
+            for entry in it:
+                if entry.name.endswith(".png"):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def _evict_locked():
+    """Delete least-recently-used renders until the cache is under 90% of its budget."""
+    global _total_bytes
+    entries = sorted(_scan())
+    total = sum(size for _, size, _ in entries)
+    target = int(RENDER_CACHE_MAX_BYTES * 0.9)
+    for _, size, path in entries:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            _stats["evicted"] += 1
+        except OSError:
+            pass
+    _total_bytes = total
+
+
+def render_page_png(file_path, content_hash, page_index, dpi=None):
+    """Return a page rendered as PNG, rasterising it at most once per (file hash, page, DPI)."""
+    global _total_bytes
+    dpi = dpi or RENDER_DPI
+    path = _cache_path(content_hash, page_index, dpi)
+    try:
+        with open(path, "rb") as f:
+            img_bytes = f.read()
+        # 命中时刷新 mtime，作为 LRU 的访问时间
+        os.utime(path, None)
+        with _lock:
+            _stats["hits"] += 1
+        return img_bytes
+    except FileNotFoundError:
+        pass
+
+    import pymupdf
+    with pymupdf.open(file_path) as doc:
+        img_bytes = doc[page_index].get_pixmap(dpi=dpi).tobytes("png")
+    os.makedirs(RENDER_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(img_bytes)
+    os.replace(tmp_path, path)
+    with _lock:
+        _stats["misses"] += 1
+        if _total_bytes is None:
+            _total_bytes = sum(size for _, size, _ in _scan())
+        else:
+            _total_bytes += len(img_bytes)
+        if _total_bytes > RENDER_CACHE_MAX_BYTES:
+            _evict_locked()
+    return img_bytes
+
+
+def get_render_cache_stats():
+    with _lock:
+        stats = dict(_stats)
+    entries = _scan()
+    stats.update({"files": len(entries), "bytes": sum(size for _, size, _ in entries), "max_bytes": RENDER_CACHE_MAX_BYTES})
+    return stats
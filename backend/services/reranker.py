@@ -0,0 +1,112 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "0") == "1"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "BAAI/bge-reranker-base")
+# 先召回 RERANK_FETCH_K 个候选，重排后最多保留 RERANK_TOP_N 个且分数不低于阈值
+RERANK_FETCH_K = int(os.getenv("RERANK_FETCH_K", "20"))
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "3"))
+RERANK_THRESHOLD = float(os.getenv("RERANK_THRESHOLD", "0.1"))
+# 即使全部低于阈值也至少保留的分块数
+RERANK_MIN_KEEP = int(os.getenv("RERANK_MIN_KEEP", "1"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "32"))
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "512"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "50000"))
+
+_lock = threading.Lock()
+_model = None
+_model_lock = threading.Lock()
+_scores = OrderedDict()
+_stats = {"calls": 0, "pairs_scored": 0, "cache_hits": 0, "candidates": 0, "kept": 0, "seconds": 0.0}
+
+
+def _get_model():
+    global _model
+    with _model_lock:
+        if _model is None:
+            from sentence_transformers import CrossEncoder
+            started = time.perf_counter()
+            _model = CrossEncoder(RERANK_MODEL, device="cpu", max_length=RERANK_MAX_LENGTH)
+            print(f"重排模型已加载 {RERANK_MODEL}，耗时 {time.perf_counter() - started:.2f}s")
+        return _model
+
+
+def _pair_key(query, doc):
+    from services.rag_service import chunk_fingerprint
+    return hashlib.sha1(query.encode("utf-8")).hexdigest(), chunk_fingerprint(doc)
+
+
+def score_pairs(pairs):
+    """Relevance scores (0-1) for [(query, doc)]; uncached pairs are scored in one batched CPU pass."""
+    keys = [_pair_key(q, d) for q, d in pairs]
+    scores = [None] * len(pairs)
+    missing = []
+    with _lock:
+        for i, key in enumerate(keys):
+            score = _scores.get(key)
+            if score is None:
+                missing.append(i)
+            else:
+                _scores.move_to_end(key)
+                scores[i] = score
+        _stats["cache_hits"] += len(pairs) - len(missing)
+    if missing:
+        started = time.perf_counter()
+        model = _get_model()
+        with _model_lock:
+            predicted = model.predict(
+                [(pairs[i][0], pairs[i][1].page_content) for i in missing],
+                batch_size=RERANK_BATCH_SIZE,
+                show_progress_bar=False,
+            )
+        elapsed = time.perf_counter() - started
+        with _lock:
+            for i, score in zip(missing, predicted):
+                scores[i] = float(score)
+                _scores[keys[i]] = float(score)
+            while len(_scores) > RERANK_CACHE_SIZE:
+                _scores.popitem(last=False)
+            _stats["pairs_scored"] += len(missing)
+            _stats["seconds"] += elapsed
+    return scores
+
+
+def rerank_batch(candidates_by_query, top_n=None, threshold=None, min_keep=None):
+    """Rerank {query: [Document]} with a single cross-encoder batch; returns {query: top documents}.
+
+    Keeps at most top_n documents scoring at least threshold (but never fewer than
+    min_keep when candidates exist).
+    """
+    top_n = top_n or RERANK_TOP_N
+    threshold = RERANK_THRESHOLD if threshold is None else threshold
+    min_keep = RERANK_MIN_KEEP if min_keep is None else min_keep
+    pairs = [(q, d) for q, docs in candidates_by_query.items() for d in docs]
+    scores = iter(score_pairs(pairs)) if pairs else iter(())
+    results = {}
+    kept = 0
+    for q, docs in candidates_by_query.items():
+        ranked = sorted(zip(docs, (next(scores) for _ in docs)), key=lambda item: item[1], reverse=True)
+        selected = [d for d, s in ranked[:top_n] if s >= threshold]
+        if len(selected) < min_keep:
+            selected = [d for d, _ in ranked[:min(min_keep, top_n)]]
+        results[q] = selected
+        kept += len(selected)
+    with _lock:
+        _stats["calls"] += 1
+        _stats["candidates"] += len(pairs)
+        _stats["kept"] += kept
+    return results
+
+
+def get_rerank_stats():
+    with _lock:
+        stats = dict(_stats)
+        stats["cached_pairs"] = len(_scores)
+    stats.update({"enabled": RERANK_ENABLED, "model": RERANK_MODEL, "fetch_k": RERANK_FETCH_K, "top_n": RERANK_TOP_N, "threshold": RERANK_THRESHOLD})
+    return stats
@@ -0,0 +1,61 @@
+import os
+import re
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 表格线（lines + rects）数量达到该值即视为候选页
+TABLE_MIN_RULINGS = int(os.getenv("TABLE_MIN_RULINGS", "6"))
+# 数字 token 占比（汉字按字计）与最少数量
+TABLE_MIN_NUMERIC_RATIO = float(os.getenv("TABLE_MIN_NUMERIC_RATIO", "0.2"))
+TABLE_MIN_NUMERIC_TOKENS = int(os.getenv("TABLE_MIN_NUMERIC_TOKENS", "8"))
+
+# 关键词只在数字密度接近阈值时作为加分项，且按表格上下文的写法匹配，避免正文里的“表示”“排放”等误判
+TABLE_KEYWORD_PATTERNS = [
+    r"表\s*[\d一二三四五六七八九十]+",
+    r"(?:合计|总计|小计)\s*[:：]?\s*[-+]?\d",
+    r"单位\s*[:：(（]",
+    r"(?:19|20)\d{2}\s*年?度?\s+(?:19|20)\d{2}",
+    r"范围\s*[一二三123]|scope\s*[123]",
+    r"\d\s*(?:tco2e|kwh|mwh|gj|吨|千克|公斤)",
+]
+
+_NUMBER_RE = re.compile(r"[-+]?\d[\d,]*\.?\d*%?")
+# 汉字逐字计数，否则整句中文只算一个 token，正文页的数字占比会被高估
+_TOKEN_RE = re.compile(r"[-+]?\d[\d,]*\.?\d*%?|[A-Za-z]+|[一-鿿]")
+_KEYWORD_RES = [re.compile(p, re.IGNORECASE) for p in TABLE_KEYWORD_PATTERNS]
+
+
+def page_table_signals(page):
+    """Cheap per-page features from a parsed-document page."""
+    text = page.get("text") or ""
+    tokens = _TOKEN_RE.findall(text)
+    numeric = sum(1 for t in tokens if _NUMBER_RE.fullmatch(t))
+    return {
+        "rulings": page.get("line_count", 0) + page.get("rect_count", 0),
+        "numeric_tokens": numeric,
+        "numeric_ratio": numeric / len(tokens) if tokens else 0.0,
+        "keyword_hits": sum(1 for pattern in _KEYWORD_RES if pattern.search(text)),
+        "pdfplumber_tables": len(page.get("tables") or []),
+    }
+
+
+def is_table_candidate(page):
+    signals = page_table_signals(page)
+    if signals["pdfplumber_tables"]:
+        return True
+    if signals["rulings"] >= TABLE_MIN_RULINGS and signals["numeric_tokens"] >= 3:
+        return True
+    if signals["numeric_tokens"] >= TABLE_MIN_NUMERIC_TOKENS and signals["numeric_ratio"] >= TABLE_MIN_NUMERIC_RATIO:
+        return True
+    # 数字密度达到阈值一半的边缘页，再由表格关键词决定；关键词本身不足以判为表格页
+    near_table = (
+        signals["numeric_ratio"] >= TABLE_MIN_NUMERIC_RATIO / 2
+        and signals["numeric_tokens"] >= TABLE_MIN_NUMERIC_TOKENS // 2
+    )
+    return near_table and signals["keyword_hits"] >= 2
+
+
+def select_table_candidate_pages(pages):
+    """Return the 0-based indices of pages likely to contain KPI tables."""
+    return [page["page"] for page in pages if is_table_candidate(page)]
@@ -5,19 +5,65 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-def update_from_document(session_id, files=None):
+# 增量模式：检索结果未变化的题目直接沿用上次答案，不再调用 LLM/VL
+QUESTIONNAIRE_INCREMENTAL = os.getenv("QUESTIONNAIRE_INCREMENTAL", "1") not in ("0", "false", "False")
+
+# 批量模式：所有 KPI 按页合并为一次 VL 调用
+VL_BATCH_MODE = os.getenv("VL_BATCH_MODE", "1") not in ("0", "false", "False")
+
+KPI_KEYS = ["scope1", "scope2", "scope3", "energy_total", "renewable_ratio", "hazardous_waste", "nonhazardous_waste", "recycled_waste"]
+
+
+def _first_vl_number(vl_extraction):
+    """Return (value, ref) for the first VL response that parses as a number."""
+    for ref, v in vl_extraction.items():
+        try:
+            return float(str(v).replace("%", "").replace(",", "").strip()), ref
+        except Exception:
+            continue
+    return None, None
+
+
+def _apply_float_answer(key, values, sources, vl_value, vl_ref, answer_update, answer_sources, answer_conflicts):
+    if vl_value is not None:
+        answer_update[key] = vl_value
+        # 记录VL图片来源ref
+        answer_sources[key] = [vl_ref] if vl_ref else ["VL图片抽取"]
+    elif values:
+        answer_update[key] = values[0]
+        answer_sources[key] = [sources[0]]
+        unique_values = []
+        for val in values:
+            if all(abs(val - existing) > 1e-6 for existing in unique_values):
+                unique_values.append(val)
+        if len(unique_values) > 1:
+            answer_conflicts[key] = [
+                {"value": val, "source": src}
+                for val, src in zip(values, sources)
+            ]
+    else:
+        answer_update[key] = None
+
+
+def update_from_document(session_id, files=None, progress=None, incremental=None, retrieval_cache=None, content_hashes=None):
     # 可选 files: 若有则加载、分块、向量化，否则仅用 session_id 检索
+    # 可选 progress: callable(stage, **detail)，供异步任务上报阶段进度
+    # 可选 incremental: 覆盖 QUESTIONNAIRE_INCREMENTAL
+    # 可选 retrieval_cache: 跨阶段共享的检索结果缓存 {(query, k, mode, rerank): docs}，见 search_docs_batch
+    # 可选 content_hashes: 上传时已算好的 {文件路径: sha256}，入库时不再重复计算
     from langchain_postgres.vectorstores import PGVector
     from langchain_community.document_loaders import TextLoader, PDFPlumberLoader, Docx2txtLoader
     from langchain_text_splitters import RecursiveCharacterTextSplitter
     from langchain_community.embeddings import DashScopeEmbeddings
 
     # Vectorstore and RAG utilities moved to services.rag_service
-    from services.rag_service import ingest_files, search_docs, run_rag_on_question, run_module_level_rag, save_answers, get_llm, _ai_to_text
+    from services.rag_service import ingest_files, search_docs_batch, run_rag_on_question, run_module_level_rag, save_answers, get_llm, _ai_to_text, chunk_fingerprint
 
     # 1. 如 files 存在，先写入向量库（委托给 rag_service）
     if files:
-        ingest_files(session_id, files)
+        if progress:
+            progress("ingest", files=len(files))
+        ingest_files(session_id, files, progress=progress, content_hashes=content_hashes)
 
 
     def format_source(metadata):
@@ -34,7 +80,8 @@ def update_from_document(session_id, files=None):
     # Extract company name
     company_name = "该企业"
     try:
-        docs_for_name = search_docs(session_id, "本文档提到的企业或公司名称是什么？", k=1)
+        name_query = "本文档提到的企业或公司名称是什么？"
+        docs_for_name = search_docs_batch(session_id, [name_query], k=1, cache=retrieval_cache)[name_query]
         if docs_for_name:
             llm = get_llm()
             name_prompt = f"请从以下内容中提取企业或公司名称，只输出名称，不要解释。\n内容：{docs_for_name[0].page_content}"
@@ -132,57 +179,83 @@ def update_from_document(session_id, files=None):
             "type": "float"
         }
     }
+    if incremental is None:
+        incremental = QUESTIONNAIRE_INCREMENTAL
+    previous = {"answers": {}, "answer_sources": {}, "answer_conflicts": {}}
+    if incremental:
+        from chains.questionnaire_chain import get_questionnaire
+        previous = get_questionnaire(session_id)
+    previous_answers = previous.get("answers") or {}
+    previous_retrieval = previous_answers.get("_retrieval") or {}
+
     answer_update = {}
     answer_sources = {}
     answer_conflicts = {}
-    for key, qinfo in questions.items():
+    retrieval_state = {}
+    skipped = []
+    pending_kpi = {}
+    indexed_kpi = []
+    # 入库时建立的 KPI 候选索引，命中的数值题不再调用 LLM/VL
+    kpi_index = {}
+    from services.kpi_candidates import KPI_INDEX_ENABLED, KPI_MAX_CANDIDATES, lookup_kpi_candidates, is_confident, format_hints
+    if KPI_INDEX_ENABLED:
+        try:
+            kpi_index = lookup_kpi_candidates(session_id, keys=KPI_KEYS)
+        except Exception as e:
+            print(f"KPI 候选索引查询失败: {e}")
+    # 所有问题的检索合并为一次 embedding 与一次数据库查询
+    retrieved = search_docs_batch(session_id, [q["question"] for q in questions.values()], k=3, cache=retrieval_cache)
+    for index, (key, qinfo) in enumerate(questions.items()):
+        if progress:
+            progress("questionnaire", completed=index, total=len(questions), current=key, skipped=len(skipped))
         question = qinfo["question"]
         qtype = qinfo["type"]
         options = qinfo.get("options", [])
-        docs = search_docs(session_id, question, k=3)
+        docs = retrieved.get(question, [])
+        # 记录每题答案所依据的分块，供下次增量比对
+        fingerprint = {"question": question, "chunks": [chunk_fingerprint(d) for d in docs]}
+        candidates = kpi_index.get(key, [])[:KPI_MAX_CANDIDATES] if qtype == "float" else []
+        if candidates:
+            # 索引命中的数值题以候选值为准，候选变化时不能沿用上次答案
+            fingerprint["kpi_candidates"] = [[c["value"], c["source_file"], c["page"]] for c in candidates]
+        retrieval_state[key] = fingerprint
+        if incremental and previous_retrieval.get(key) == fingerprint and key in previous_answers:
+            answer_update[key] = previous_answers[key]
+            for suffix in ("_modules", "_module_details", "_module_summary"):
+                if f"{key}{suffix}" in previous_answers:
+                    answer_update[f"{key}{suffix}"] = previous_answers[f"{key}{suffix}"]
+            for field in (key, f"{key}_modules"):
+                if field in previous["answer_sources"]:
+                    answer_sources[field] = previous["answer_sources"][field]
+            if key in previous["answer_conflicts"]:
+                answer_conflicts[key] = previous["answer_conflicts"][key]
+            skipped.append(key)
+            continue
+        if candidates and is_confident(candidates):
+            values = [c["value"] for c in candidates]
+            sources = [f"{c['source_file']}:{c['page'] + 1}" if c["page"] is not None else c["source_file"] for c in candidates]
+            _apply_float_answer(key, values, sources, None, None, answer_update, answer_sources, answer_conflicts)
+            indexed_kpi.append(key)
+            continue
         values, sources = ([], [])
         if docs:
-            values, sources = run_rag_on_question(session_id, question, qtype, options, k=3)
+            # 置信度不足的索引候选只作为提示，仍由 LLM/VL 依据原文作答
+            hints = format_hints(candidates) if candidates else None
+            values, sources = run_rag_on_question(session_id, question, qtype, options, k=3, docs=docs, hints=hints)
 
         if qtype == "float":
-            vl_value = None
-            # KPI类字段通过API调用VL模型抽取
-            if key in ["scope1", "scope2", "scope3", "energy_total", "renewable_ratio", "hazardous_waste", "nonhazardous_waste", "recycled_waste"]:
-                try:
-                    from services.rag_service import run_vl_kpi_extraction
-                    vl_docs = docs or search_docs(session_id, question, k=3)
-                    vl_extraction = run_vl_kpi_extraction(vl_docs, key)
-                    vl_ref = None
-                    for ref, v in vl_extraction.items():
-                        try:
-                            vl_value = float(str(v).replace("%", "").replace(",", "").strip())
-                            vl_ref = ref
-                            break
-                        except Exception:
-                            continue
-                except Exception as e:
-                    print(f"VL KPI抽取失败: {e}")
-            if vl_value is not None:
-                answer_update[key] = vl_value
-                # 记录VL图片来源ref
-                if 'vl_ref' in locals() and vl_ref:
-                    answer_sources[key] = [vl_ref]
-                else:
-                    answer_sources[key] = ["VL图片抽取"]
-            elif values:
-                answer_update[key] = values[0]
-                answer_sources[key] = [sources[0]]
-                unique_values = []
-                for val in values:
-                    if all(abs(val - existing) > 1e-6 for existing in unique_values):
-                        unique_values.append(val)
-                if len(unique_values) > 1:
-                    answer_conflicts[key] = [
-                        {"value": val, "source": src}
-                        for val, src in zip(values, sources)
-                    ]
+            # KPI类字段通过API调用VL模型抽取；批量模式下先收集，循环结束后按页合并调用
+            if key in KPI_KEYS and VL_BATCH_MODE:
+                pending_kpi[key] = (docs, values, sources)
             else:
-                answer_update[key] = None
+                vl_value, vl_ref = None, None
+                if key in KPI_KEYS:
+                    try:
+                        from services.rag_service import run_vl_kpi_extraction
+                        vl_value, vl_ref = _first_vl_number(run_vl_kpi_extraction(docs, key))
+                    except Exception as e:
+                        print(f"VL KPI抽取失败: {e}")
+                _apply_float_answer(key, values, sources, vl_value, vl_ref, answer_update, answer_sources, answer_conflicts)
         elif qtype == "text":
             if values:
                 answer_update[key] = values[0]
@@ -210,6 +283,22 @@ def update_from_document(session_id, files=None):
             answer_update[f"{key}_modules"] = modules
             answer_update[f"{key}_module_details"] = module_details
             answer_update[f"{key}_module_summary"] = summary_text
+    if pending_kpi:
+        # 每页一次 VL 调用，同时抽取该页涉及的全部 KPI
+        try:
+            from services.rag_service import run_vl_kpi_extraction_batch
+            vl_batch = run_vl_kpi_extraction_batch({key: docs for key, (docs, _, _) in pending_kpi.items()})
+        except Exception as e:
+            print(f"VL KPI批量抽取失败: {e}")
+            vl_batch = {}
+        for key, (docs, values, sources) in pending_kpi.items():
+            vl_value, vl_ref = _first_vl_number(vl_batch.get(key, {}))
+            _apply_float_answer(key, values, sources, vl_value, vl_ref, answer_update, answer_sources, answer_conflicts)
+    answer_update["_retrieval"] = retrieval_state
+    if skipped:
+        print(f"[增量问卷] 检索结果未变化，沿用上次答案: {', '.join(skipped)}")
+    if indexed_kpi:
+        print(f"[KPI候选索引] 直接命中，跳过 LLM/VL: {', '.join(indexed_kpi)}")
     # 更新 answers 表
     # 将结果保存到数据库
     print("[问卷自动抽取结果]")
@@ -0,0 +1,52 @@
+from dotenv import load_dotenv
+
+load_dotenv()
+
+KPI_CONTEXT_QUESTIONS = {
+    "scope1": "企业的Scope 1（直接排放）是多少？",
+    "scope2": "企业的Scope 2（能源间接排放）是多少？",
+    "scope3": "企业的Scope 3（上下游其他间接排放）是多少？",
+    "energy_total": "企业的总能耗是多少？",
+    "renewable_ratio": "企业的可再生能源占比是多少？",
+    "hazardous_waste": "企业的危险废弃物总量是多少？",
+    "nonhazardous_waste": "企业的非危险废弃物总量是多少？",
+    "recycled_waste": "企业的回收/再利用废弃物总量是多少？"
+}
+
+
+def run_upload_pipeline(session_id, file_paths, progress=None, content_hashes=None):
+    """Ingest uploaded files, refresh the questionnaire and collect KPI RAG contexts.
+
+    progress: optional callable(stage, **detail) used by the job worker to report
+    stage-level progress ("ingest", "questionnaire", "kpi_contexts").
+    content_hashes: optional {file path: sha256} recorded by the upload endpoint.
+    """
+    # RAG自动问卷更新
+    from services.update_questionnaire import update_from_document
+    # 同一次上传内各阶段共享检索结果
+    retrieval_cache = {}
+    update_from_document(session_id, file_paths, progress=progress, retrieval_cache=retrieval_cache, content_hashes=content_hashes)
+    # 收集RAG检索内容和summary
+    if progress:
+        progress("kpi_contexts", total=len(KPI_CONTEXT_QUESTIONS))
+    from services.rag_service import search_docs_batch, save_answers
+    rag_contexts = {}
+    summary = []
+    retrieved = search_docs_batch(session_id, list(KPI_CONTEXT_QUESTIONS.values()), k=1, cache=retrieval_cache)
+    for key, question in KPI_CONTEXT_QUESTIONS.items():
+        docs = retrieved.get(question, [])
+        if docs:
+            rag_contexts[key] = docs[0].page_content
+            summary.append(f"[{key}] {question}\n→ {docs[0].page_content[:200]}...")
+        else:
+            rag_contexts[key] = "未检索到相关内容"
+            summary.append(f"[{key}] {question}\n→ 未检索到相关内容")
+    # 将rag_contexts和summary写入answers表，保留问卷抽取写入的来源与冲突
+    from chains.questionnaire_chain import get_questionnaire
+    current = get_questionnaire(session_id)
+    answer_update = {"_rag_contexts": rag_contexts, "_summary": "\n\n".join(summary)}
+    save_answers(session_id, answer_update, current["answer_sources"], current["answer_conflicts"])
+    result = get_questionnaire(session_id)
+    result["rag_contexts"] = rag_contexts
+    result["summary"] = "\n\n".join(summary)
+    return result
@@ -0,0 +1,328 @@
+import os
+import time
+import threading
+from db.db import get_conn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# hnsw | ivfflat | none
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "hnsw").lower()
+# text-embedding-v1 为 1536 维；ANN 索引要求 embedding 列声明固定维度
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "1536"))
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "40"))
+# pgvector >= 0.8：过滤后结果不足 k 条时继续扫描索引（off | strict_order | relaxed_order）
+HNSW_ITERATIVE_SCAN = os.getenv("HNSW_ITERATIVE_SCAN", "relaxed_order")
+# 0 表示按行数自动估算（rows/1000，超过 100 万行时取 sqrt(rows)）
+IVFFLAT_LISTS = int(os.getenv("IVFFLAT_LISTS", "0"))
+IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES", "10"))
+
+COLLECTION_INDEX = "ix_langchain_pg_embedding_collection_id"
+ANN_INDEXES = {
+    "hnsw": "ix_langchain_pg_embedding_hnsw",
+    "ivfflat": "ix_langchain_pg_embedding_ivfflat",
+}
+# 多进程（API 与 worker）同时启动时只允许一个建索引
+_ADVISORY_LOCK_KEY = 7302418911
+_lock = threading.Lock()
+_pgvector_version = None
+_status = {"index_type": VECTOR_INDEX_TYPE, "ready": False, "last_error": None, "build_seconds": None}
+
+
+def _version_tuple(version):
+    parts = []
+    for p in (version or "0").split("."):
+        digits = "".join(ch for ch in p if ch.isdigit())
+        parts.append(int(digits or 0))
+    return tuple(parts)
+
+
+def get_pgvector_version(cur=None):
+    """Installed pgvector extension version as a tuple, e.g. (0, 5, 1); cached per process."""
+    global _pgvector_version
+    if _pgvector_version is not None:
+        return _pgvector_version
+    if cur is None:
+        conn = get_conn()
+        with conn:
+            with conn.cursor() as c:
+                version = get_pgvector_version(c)
+        conn.close()
+        return version
+    cur.execute("SELECT extversion FROM pg_extension WHERE extname='vector'")
+    row = cur.fetchone()
+    _pgvector_version = _version_tuple(row[0] if row else None)
+    return _pgvector_version
+
+
+def search_settings(version=None):
+    """Session settings [(name, value)] applied to every connection used for similarity search."""
+    version = version or _pgvector_version or (0,)
+    index_type = _status["index_type"]
+    if index_type == "hnsw":
+        settings = [("hnsw.ef_search", str(HNSW_EF_SEARCH))]
+        if version >= (0, 8) and HNSW_ITERATIVE_SCAN != "off":
+            settings.append(("hnsw.iterative_scan", HNSW_ITERATIVE_SCAN))
+        return settings
+    if index_type == "ivfflat":
+        settings = [("ivfflat.probes", str(IVFFLAT_PROBES))]
+        if version >= (0, 8) and HNSW_ITERATIVE_SCAN != "off":
+            settings.append(("ivfflat.iterative_scan", "relaxed_order"))
+        return settings
+    return []
+
+
+def apply_search_settings(cur, local=True):
+    """Apply ef_search / probes on a psycopg2 cursor (SET LOCAL: only for the current transaction)."""
+    settings = search_settings(get_pgvector_version(cur))
+    for name, value in settings:
+        cur.execute(f"SET {'LOCAL ' if local else ''}{name} = %s", (value,))
+
+
+def install_engine_listener(engine):
+    """Apply the search settings on every new connection of a SQLAlchemy engine (used by PGVector)."""
+    from sqlalchemy import event
+
+    def on_connect(dbapi_conn, _record):
+        try:
+            cur = dbapi_conn.cursor()
+            apply_search_settings(cur, local=False)
+            cur.close()
+            dbapi_conn.commit()
+        except Exception as e:
+            print(f"向量检索参数设置失败: {e}")
+            dbapi_conn.rollback()
+
+    event.listen(engine, "connect", on_connect)
+
+
+def _index_state(cur, name):
+    cur.execute(
+        """
+        SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid
+        WHERE c.relname = %s
+        """,
+        (name,),
+    )
+    row = cur.fetchone()
+    return None if row is None else bool(row[0])
+
+
+def _ivfflat_lists(rows):
+    if IVFFLAT_LISTS > 0:
+        return IVFFLAT_LISTS
+    if rows > 1_000_000:
+        return int(rows ** 0.5)
+    return max(10, rows // 1000)
+
+
+def _embedding_typmod(cur):
+    cur.execute(
+        """
+        SELECT a.atttypmod FROM pg_attribute a
+        WHERE a.attrelid = 'langchain_pg_embedding'::regclass AND a.attname = 'embedding'
+        """
+    )
+    row = cur.fetchone()
+    return None if row is None else row[0]
+
+
+def _has_fixed_dimension(cur):
+    """Whether embedding is declared as vector(EMBEDDING_DIM); only checks, never alters the table."""
+    typmod = _embedding_typmod(cur)
+    if typmod == EMBEDDING_DIM:
+        return True
+    if typmod in (-1, None):
+        print("embedding 列未声明维度，跳过 ANN 索引；请先执行 python -m services.vector_index migrate-dim")
+    else:
+        print(f"embedding 列维度为 {typmod}，与 EMBEDDING_DIM={EMBEDDING_DIM} 不一致，跳过 ANN 索引")
+    return False
+
+
+def migrate_embedding_dimension():
+    """One-off migration: declare embedding as vector(EMBEDDING_DIM) when langchain_postgres created it without a dimension.
+
+    Rewrites the table under an ACCESS EXCLUSIVE lock, so run it during a maintenance window. Returns True when the
+    column has the fixed dimension afterwards.
+    """
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('langchain_pg_embedding')")
+            if cur.fetchone()[0] is None:
+                print("langchain_pg_embedding 不存在，无需迁移")
+                ok = False
+            else:
+                typmod = _embedding_typmod(cur)
+                if typmod == EMBEDDING_DIM:
+                    print(f"embedding 列已是 vector({EMBEDDING_DIM})")
+                    ok = True
+                elif typmod not in (-1, None):
+                    print(f"embedding 列维度为 {typmod}，与 EMBEDDING_DIM={EMBEDDING_DIM} 不一致，不做修改")
+                    ok = False
+                else:
+                    cur.execute("SELECT count(*) FROM langchain_pg_embedding WHERE vector_dims(embedding) <> %s", (EMBEDDING_DIM,))
+                    mismatched = cur.fetchone()[0]
+                    if mismatched:
+                        print(f"有 {mismatched} 条向量维度不是 {EMBEDDING_DIM}，不做修改")
+                        ok = False
+                    else:
+                        started = time.perf_counter()
+                        cur.execute(f"ALTER TABLE langchain_pg_embedding ALTER COLUMN embedding TYPE vector({EMBEDDING_DIM})")
+                        print(f"embedding 列已改为 vector({EMBEDDING_DIM})，耗时 {time.perf_counter() - started:.2f}s")
+                        ok = True
+    conn.close()
+    return ok
+
+
+def update_extension():
+    """Upgrade the installed pgvector extension to the version shipped with the server image."""
+    global _pgvector_version
+    conn = get_conn()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("ALTER EXTENSION vector UPDATE")
+            _pgvector_version = None
+            version = get_pgvector_version(cur)
+    conn.close()
+    print(f"pgvector 扩展版本: {'.'.join(map(str, version))}")
+    return version
+
+
+def ensure_vector_indexes(index_type=None):
+    """Create the collection_id index and the configured ANN index on langchain_pg_embedding.
+
+    Indexes are built CONCURRENTLY so ingestion keeps writing; an invalid index
+    left behind by an interrupted build is dropped and rebuilt. Returns the status dict.
+    """
+    index_type = (index_type or VECTOR_INDEX_TYPE).lower()
+    with _lock:
+        started = time.perf_counter()
+        conn = get_conn()
+        # CREATE INDEX CONCURRENTLY 不能在事务块中执行
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT to_regclass('langchain_pg_embedding')")
+                if cur.fetchone()[0] is None:
+                    # 表由 langchain_postgres 在首次入库时创建，下次启动再建索引
+                    _status.update({"ready": False, "last_error": "langchain_pg_embedding 不存在"})
+                    return dict(_status)
+                cur.execute("SELECT pg_try_advisory_lock(%s)", (_ADVISORY_LOCK_KEY,))
+                if not cur.fetchone()[0]:
+                    print("其他进程正在创建向量索引，跳过")
+                    return dict(_status)
+                # ANN 索引未建成的原因；不为 None 时不能报告 ready
+                ann_error = None
+                try:
+                    version = get_pgvector_version(cur)
+                    _create_index(cur, COLLECTION_INDEX, "USING btree (collection_id)")
+                    if index_type in ANN_INDEXES:
+                        if index_type == "hnsw" and version < (0, 5):
+                            print(f"pgvector {'.'.join(map(str, version))} 不支持 HNSW，改用 IVFFlat")
+                            index_type = "ivfflat"
+                        if not _has_fixed_dimension(cur):
+                            ann_error = "embedding 列未声明固定维度，未创建 ANN 索引（python -m services.vector_index migrate-dim）"
+                        elif index_type == "hnsw":
+                            _create_index(
+                                cur, ANN_INDEXES["hnsw"],
+                                f"USING hnsw (embedding vector_cosine_ops) WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION})",
+                            )
+                        else:
+                            cur.execute("SELECT count(*) FROM langchain_pg_embedding")
+                            rows = cur.fetchone()[0]
+                            if rows == 0:
+                                # IVFFlat 的聚类中心依赖已有数据，空表建索引召回很差
+                                print("langchain_pg_embedding 为空，暂不创建 IVFFlat 索引")
+                                ann_error = "langchain_pg_embedding 为空，暂未创建 IVFFlat 索引"
+                            else:
+                                _create_index(
+                                    cur, ANN_INDEXES["ivfflat"],
+                                    f"USING ivfflat (embedding vector_cosine_ops) WITH (lists = {_ivfflat_lists(rows)})",
+                                )
+                    cur.execute("ANALYZE langchain_pg_embedding")
+                finally:
+                    cur.execute("SELECT pg_advisory_unlock(%s)", (_ADVISORY_LOCK_KEY,))
+            _status.update({
+                # 没有 ANN 索引时不再下发 ef_search / probes
+                "index_type": index_type if ann_error is None else "none",
+                "ready": ann_error is None,
+                "last_error": ann_error,
+                "build_seconds": round(time.perf_counter() - started, 2),
+            })
+        except Exception as e:
+            print(f"创建向量索引失败: {e}")
+            _status.update({"ready": False, "last_error": str(e)})
+        finally:
+            conn.close()
+        return dict(_status)
+
+
+def _create_index(cur, name, definition):
+    state = _index_state(cur, name)
+    if state is True:
+        return
+    if state is False:
+        print(f"索引 {name} 无效（上次创建中断），重建")
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    started = time.perf_counter()
+    cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON langchain_pg_embedding {definition}")
+    print(f"已创建索引 {name}，耗时 {time.perf_counter() - started:.2f}s")
+
+
+def ensure_vector_indexes_if_missing():
+    """Retry index creation until it has succeeded once in this process (the table appears on first ingest)."""
+    if not _status["ready"]:
+        ensure_vector_indexes()
+
+
+def ensure_vector_indexes_async():
+    """Build indexes in a background thread so startup is not blocked by a first-time build."""
+    thread = threading.Thread(target=ensure_vector_indexes, name="vector-index", daemon=True)
+    thread.start()
+    return thread
+
+
+def get_vector_index_stats():
+    stats = dict(_status)
+    stats["search_settings"] = dict(search_settings())
+    try:
+        conn = get_conn()
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT c.relname, pg_relation_size(c.oid), i.indisvalid
+                    FROM pg_index i
+                    JOIN pg_class c ON c.oid = i.indexrelid
+                    WHERE i.indrelid = to_regclass('langchain_pg_embedding')
+                    """
+                )
+                stats["indexes"] = [{"name": n, "bytes": size, "valid": valid} for n, size, valid in cur.fetchall()]
+                cur.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass('langchain_pg_embedding')")
+                row = cur.fetchone()
+                stats["estimated_rows"] = row[0] if row else 0
+        conn.close()
+    except Exception as e:
+        stats["error"] = str(e)
+    return stats
+
+
+if __name__ == "__main__":
+    # 运维命令（在 backend 目录下）：
+    #   python -m services.vector_index migrate-dim       为 embedding 列声明固定维度（会重写表）
+    #   python -m services.vector_index update-extension  升级 pgvector 扩展
+    #   python -m services.vector_index build             创建/修复向量索引
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["migrate-dim", "update-extension", "build"])
+    args = parser.parse_args()
+    if args.command == "migrate-dim":
+        migrate_embedding_dimension()
+    elif args.command == "update-extension":
+        update_extension()
+    else:
+        print(ensure_vector_indexes())
@@ -0,0 +1,177 @@
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from dotenv import load_dotenv
+from pydantic import SecretStr
+
+load_dotenv()
+
+VL_MODEL = os.getenv("VL_MODEL", "qwen-vl-max")
+# 同时进行中的 VL 请求上限（进程内所有线程与事件循环共享，超时未结束的请求也计入）
+VL_MAX_CONCURRENCY = int(os.getenv("VL_MAX_CONCURRENCY", "4"))
+VL_TIMEOUT_S = float(os.getenv("VL_TIMEOUT_S", "30"))
+
+# 并发上限由线程信号量控制；线程池额外预留同样数量的线程给排队等待名额的请求
+_executor = ThreadPoolExecutor(max_workers=VL_MAX_CONCURRENCY * 2, thread_name_prefix="vl")
+_slots = threading.BoundedSemaphore(VL_MAX_CONCURRENCY)
+_llm = None
+_lock = threading.Lock()
+_stats = {
+    "calls": 0,
+    "ok": 0,
+    "empty": 0,
+    "errors": 0,
+    "timeouts": 0,
+    "cancelled_before_start": 0,
+    "slot_timeouts": 0,
+    "orphans_running": 0,
+    "orphans_finished": 0,
+    "total_s": 0.0,
+    "max_s": 0.0,
+}
+
+
+def _bump(**counts):
+    with _lock:
+        for k, v in counts.items():
+            _stats[k] += v
+
+
+def _notify(loop, event):
+    try:
+        loop.call_soon_threadsafe(event.set)
+    except RuntimeError:
+        # 调用方的事件循环已关闭
+        pass
+
+
+def _invoke_limited(llm, messages, loop, started, abandoned):
+    """Executor-side wrapper: hold a process-wide slot for the whole request, including after a caller timeout."""
+    with _slots:
+        if abandoned.is_set():
+            return None
+        _notify(loop, started)
+        return llm.invoke(messages)
+
+
+def _get_vl_llm():
+    global _llm
+    with _lock:
+        if _llm is None:
+            from langchain_community.chat_models import ChatTongyi
+            api_key = os.environ.get("DASHSCOPE_API_KEY") or ""
+            _llm = ChatTongyi(model=VL_MODEL, api_key=SecretStr(api_key))
+        return _llm
+
+
+def _on_orphan_done(_future):
+    _bump(orphans_running=-1, orphans_finished=1)
+
+
+async def ainvoke_vl(img_bytes, question, timeout_s=None):
+    """Ask the vision model about one image; returns the answer content or "" on skip/timeout/error."""
+    if not (os.environ.get("DASHSCOPE_API_KEY") or ""):
+        print("VL调用跳过：未设置DASHSCOPE_API_KEY")
+        return ""
+    from langchain_core.messages import HumanMessage
+
+    timeout_s = timeout_s or VL_TIMEOUT_S
+    message = HumanMessage(content=[{"text": question}, {"image": img_bytes}])
+    llm = _get_vl_llm()
+    loop = asyncio.get_running_loop()
+    slot_acquired = asyncio.Event()
+    abandoned = threading.Event()
+    future = _executor.submit(copy_context().run, _invoke_limited, llm, [message], loop, slot_acquired, abandoned)
+    wrapped = asyncio.wrap_future(future)
+    waiter = asyncio.ensure_future(slot_acquired.wait())
+    try:
+        # 等待名额最多 timeout_s 秒，避免个别卡住的请求拖住所有调用方；请求出错时 future 会先于名额事件完成
+        done, _ = await asyncio.wait([waiter, wrapped], timeout=timeout_s, return_when=asyncio.FIRST_COMPLETED)
+    except BaseException:
+        abandoned.set()
+        future.cancel()
+        raise
+    finally:
+        waiter.cancel()
+    if not done:
+        # 尚未拿到名额：标记放弃，之后即使拿到名额也不会发出请求
+        abandoned.set()
+        future.cancel()
+        _bump(slot_timeouts=1)
+        print(f"VL调用排队超时: {timeout_s}s")
+        return ""
+    started = time.perf_counter()
+    _bump(calls=1)
+    try:
+        result = await asyncio.wait_for(asyncio.shield(wrapped), timeout=timeout_s)
+    except asyncio.TimeoutError:
+        # 已开始执行的请求无法中断，记录为孤儿（继续占用名额），完成后自动计数
+        abandoned.set()
+        if future.cancel():
+            _bump(timeouts=1, cancelled_before_start=1)
+        else:
+            _bump(timeouts=1, orphans_running=1)
+            future.add_done_callback(_on_orphan_done)
+        print(f"VL调用超时: {timeout_s}s")
+        return ""
+    except Exception as e:
+        _bump(errors=1)
+        print(f"VL调用失败: {e}")
+        return ""
+    finally:
+        elapsed = time.perf_counter() - started
+        with _lock:
+            _stats["total_s"] += elapsed
+            _stats["max_s"] = max(_stats["max_s"], elapsed)
+    content = getattr(result, "content", result)
+    _bump(ok=1 if content else 0, empty=0 if content else 1)
+    print(f"VL调用完成，耗时: {elapsed:.2f}s")
+    return content
+
+
+async def ainvoke_vl_many(requests, timeout_s=None):
+    """Run [(img_bytes, question)] concurrently within the shared limit; results keep input order."""
+    return await asyncio.gather(*(ainvoke_vl(img, q, timeout_s=timeout_s) for img, q in requests))
+
+
+def run_sync(coro):
+    """Run a coroutine from sync code, even when called inside a running event loop thread."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    # 当前线程已有事件循环（如 FastAPI async 路由），在独立线程中运行
+    result = {}
+
+    def runner():
+        try:
+            result["value"] = asyncio.run(coro)
+        except BaseException as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=runner)
+    thread.start()
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+
+def vl_qa(img_bytes, question, timeout_s=None):
+    return run_sync(ainvoke_vl(img_bytes, question, timeout_s=timeout_s))
+
+
+def vl_qa_many(requests, timeout_s=None):
+    return run_sync(ainvoke_vl_many(requests, timeout_s=timeout_s))
+
+
+def get_vl_stats():
+    with _lock:
+        stats = dict(_stats)
+    finished = stats["ok"] + stats["empty"] + stats["errors"] + stats["timeouts"]
+    stats["avg_s"] = round(stats["total_s"] / finished, 3) if finished else None
+    stats["max_concurrency"] = VL_MAX_CONCURRENCY
+    return stats
@@ -0,0 +1,83 @@
+"""
+独立的上传任务 worker：从 ingest_jobs 队列领取任务并执行解析、向量化与问卷抽取。
+可与 FastAPI 进程分开部署并横向扩容：python worker.py
+"""
+import os
+import time
+import socket
+import threading
+import traceback
+from dotenv import load_dotenv
+
+load_dotenv()
+
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "2"))
+
+
+def _heartbeat(job_id, worker_id, stop):
+    from services.job_queue import touch_job, JOB_HEARTBEAT_SECONDS
+    while not stop.wait(JOB_HEARTBEAT_SECONDS):
+        try:
+            if not touch_job(job_id, worker_id):
+                print(f"任务 {job_id} 已被其他 worker 接管")
+                return
+        except Exception as e:
+            print(f"任务心跳失败 {job_id}: {e}")
+
+
+def process_job(job_id, session_id, payload, worker_id):
+    from services.job_queue import update_job_progress, complete_job
+    from services.upload_pipeline import run_upload_pipeline
+
+    def progress(stage, **detail):
+        update_job_progress(job_id, stage, **detail)
+
+    file_paths = payload.get("file_paths", [])
+    # /upload 写盘时已计算 sha256，随任务传入避免入库时重新读取整个文件
+    content_hashes = {path: info.get("sha256") for path, info in zip(file_paths, payload.get("files", [])) if info.get("sha256")}
+    result = run_upload_pipeline(session_id, file_paths, progress=progress, content_hashes=content_hashes)
+    result["files"] = payload.get("files", [])
+    if not complete_job(job_id, result, worker_id):
+        print(f"任务 {job_id} 已被其他 worker 接管，结果未写入")
+
+
+def run_worker(worker_id=None, once=False):
+    from services.job_queue import ensure_job_table, claim_next_job, fail_job
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    ensure_job_table()
+    print(f"worker 启动: {worker_id}")
+    while True:
+        job = claim_next_job(worker_id)
+        if job is None:
+            if once:
+                return
+            time.sleep(WORKER_POLL_SECONDS)
+            continue
+        job_id, session_id, payload = job
+        started = time.time()
+        print(f"开始处理任务 {job_id} (session={session_id})")
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=_heartbeat, args=(job_id, worker_id, stop), daemon=True)
+        heartbeat.start()
+        try:
+            process_job(job_id, session_id, payload, worker_id)
+            print(f"任务完成 {job_id}, 耗时: {time.time() - started:.2f}s")
+        except Exception as e:
+            traceback.print_exc()
+            fail_job(job_id, e, worker_id)
+            print(f"任务失败 {job_id}: {e}")
+        finally:
+            stop.set()
+            heartbeat.join()
+        # 新库首次入库后才有 langchain_pg_embedding 表，此时补建向量索引；失败不影响已完成的任务
+        try:
+            from services.vector_index import ensure_vector_indexes_if_missing
+            ensure_vector_indexes_if_missing()
+        except Exception as e:
+            print(f"补建向量索引失败: {e}")
+        if once:
+            return
+
+
+if __name__ == "__main__":
+    run_worker()
@@ -24,14 +24,47 @@ def upload_page():
         import os
         backend_url = os.environ.get("BACKEND_URL", "http://fastapi-backend:8000")
         try:
-            response = requests.post(f"{backend_url}/upload", data=data, files=files)
-            st.session_state["upload_in_progress"] = False
+            # 大文件上传耗时较长；任务轮询单次请求与总等待时长分别限时
+            upload_timeout = float(os.environ.get("UPLOAD_TIMEOUT_SECONDS", "600"))
+            poll_timeout = float(os.environ.get("JOB_POLL_TIMEOUT_SECONDS", "10"))
+            max_wait = float(os.environ.get("JOB_MAX_WAIT_SECONDS", "3600"))
+            response = requests.post(f"{backend_url}/upload", data=data, files=files, timeout=upload_timeout)
             if response.ok:
                 try:
                     result = response.json()
                 except Exception as e:
+                    st.session_state["upload_in_progress"] = False
                     st.error(f"后端返回内容解析失败: {e}\n原始内容: {response.text}")
                     return
+                # 后端异步处理上传任务，轮询任务进度直到完成
+                import time
+                job_id = result.get("job_id")
+                status_box = st.empty()
+                deadline = time.monotonic() + max_wait
+                while job_id:
+                    if time.monotonic() > deadline:
+                        st.session_state["upload_in_progress"] = False
+                        st.error(f"等待文件处理超时（超过 {max_wait:.0f} 秒），任务 {job_id} 可能仍在后台运行，请稍后刷新查看")
+                        return
+                    job_resp = requests.get(f"{backend_url}/jobs/{job_id}", timeout=poll_timeout)
+                    if not job_resp.ok:
+                        st.session_state["upload_in_progress"] = False
+                        st.error(f"任务状态查询失败: {job_resp.status_code} {job_resp.text}")
+                        return
+                    result = job_resp.json()
+                    if result.get("status") in ("done", "failed"):
+                        break
+                    stage = result.get("stage") or "排队中"
+                    stage_info = (result.get("progress") or {}).get("stages", {}).get(stage, {})
+                    detail = ""
+                    if stage_info.get("total"):
+                        detail = f" ({stage_info.get('completed', 0)}/{stage_info['total']})"
+                    status_box.info(f"正在处理：{stage}{detail}")
+                    time.sleep(2)
+                st.session_state["upload_in_progress"] = False
+                if result.get("status") == "failed":
+                    st.error(f"文件处理失败: {result.get('error')}")
+                    return
                 st.session_state["upload_success"] = True
                 if "questionnaire" in result:
                     st.info(f"自动问卷抽取：{result['questionnaire']}")
@@ -40,7 +73,7 @@ def upload_page():
                 # 自动刷新问卷和审核
                 try:
                     session_id = st.session_state.get("session_id", "default")
-                    resp = requests.get(f"{backend_url}/questionnaire?session_id={session_id}")
+                    resp = requests.get(f"{backend_url}/questionnaire?session_id={session_id}", timeout=poll_timeout)
                     if resp.ok:
                         data = resp.json()
                         if "review" in data:
@@ -53,6 +86,7 @@ def upload_page():
                     st.error(f"问卷接口异常: {e}")
                 st.rerun()
             else:
+                st.session_state["upload_in_progress"] = False
                 st.error(f"上传失败，请重试。后端返回: {response.status_code} {response.text}")
         except Exception as e:
             st.session_state["upload_in_progress"] = False
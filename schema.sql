@@ -60,3 +60,64 @@ CREATE TABLE IF NOT EXISTS chat_history (
     message JSONB NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+
+-- 上传任务队列（worker 通过 FOR UPDATE SKIP LOCKED 领取）
+CREATE TABLE IF NOT EXISTS ingest_jobs (
+    id VARCHAR(64) PRIMARY KEY,
+    session_id VARCHAR(128) NOT NULL,
+    status VARCHAR(32) NOT NULL DEFAULT 'queued',
+    stage VARCHAR(64),
+    progress JSONB NOT NULL DEFAULT '{}',
+    payload JSONB NOT NULL,
+    result JSONB,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker_id VARCHAR(128),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS ix_ingest_jobs_status ON ingest_jobs (status, created_at);
+
+-- 已入库文件的内容哈希登记，用于跨会话复用分块与向量
+CREATE TABLE IF NOT EXISTS ingested_documents (
+    content_hash VARCHAR(64) NOT NULL,
+    session_id VARCHAR(128) NOT NULL,
+    source_file VARCHAR(255),
+    source_path TEXT,
+    chunk_count INTEGER,
+    embedding_model VARCHAR(128),
+    embedding_dim INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (content_hash, session_id)
+);
+
+-- embedding 缓存：模型名 + 文本哈希 → 向量，按 last_used_at 淘汰
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    model VARCHAR(128) NOT NULL,
+    text_hash VARCHAR(64) NOT NULL,
+    embedding REAL[] NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (model, text_hash)
+);
+CREATE INDEX IF NOT EXISTS ix_embedding_cache_last_used ON embedding_cache (last_used_at);
+
+-- 入库时抽取的数值 KPI 候选（指标名 + 数值 + 单位），按文件内容哈希关联会话
+CREATE TABLE IF NOT EXISTS kpi_candidates (
+    id SERIAL PRIMARY KEY,
+    content_hash VARCHAR(64) NOT NULL,
+    kpi_key VARCHAR(64) NOT NULL,
+    value DOUBLE PRECISION NOT NULL,
+    unit VARCHAR(32),
+    raw_text TEXT,
+    label TEXT,
+    page INTEGER,
+    source_type VARCHAR(16),
+    snippet TEXT,
+    confidence REAL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS ix_kpi_candidates_hash_key ON kpi_candidates (content_hash, kpi_key);